@@ -0,0 +1,132 @@
+"""
+Accidentals looked for where they can be, after the noteheads and clefs are found:
+in a window to the left of every notehead and in the key-signature zone right of every
+clef, instead of over the whole page. The accidentals are paired with their noteheads
+and clefs by the same geometry, giving note_acc.txt and key_sig.txt directly (in the
+format match_accidents.match_acc writes them).
+
+Windows are in staff spaces, for the centre of an accidental's match box.
+"""
+import cv2
+import numpy as np
+
+from match_peaks import response_peaks
+from match_accidents import accident_entry, note_entry, clef_entry, get_key_sig
+
+
+# Accidental centre relative to its notehead's centre: (x range), (y range). Chords push
+# accidentals further left; flats sit higher than the note they alter
+NOTE_WINDOW = ((-3.2, -0.8), (-1.0, 0.75))
+
+# Key signatures start right of the clef and hold up to 7 accidentals
+KEY_LENGTH = 8.0
+
+# Most height difference between a paired accidental ('loc', see accident_entry) and notehead
+PAIR_HEIGHT = 0.75
+
+
+def accidental_windows(shape, notes, clefs, staff_space):
+    """
+    Mask (uint8, 255 inside) of the page positions where an accidental's centre may be:
+    the NOTE_WINDOW of every notehead and the KEY_LENGTH zone after every clef.
+
+    :param notes, clefs: Matches ((x0, y0), (x1, y1), score, name) in page coordinates.
+    """
+    windows = np.zeros(shape[:2], dtype=np.uint8)
+    (left, right), (top, bottom) = NOTE_WINDOW
+    for (x0, y0), (x1, y1), _, _ in notes:
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        cv2.rectangle(windows, (int(cx + left * staff_space), int(cy + top * staff_space)),
+                      (int(cx + right * staff_space), int(cy + bottom * staff_space)), 255, -1)
+    for (x0, y0), (x1, y1), _, _ in clefs:
+        cv2.rectangle(windows, (int(x1), int(y0 - staff_space / 2)),
+                      (int(x1 + KEY_LENGTH * staff_space), int(y1 + staff_space / 2)), 255, -1)
+    return windows
+
+
+def window_match(page, templates, threshold, windows, top_k=None):
+    """
+    TM_CCOEFF_NORMED of every template only where windows allows its centre: each
+    connected window is cropped (with the template's size around it) and matched alone.
+
+    :return: Generator of (template, [((x, y), score), ...]) with page top-left corners.
+    """
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(windows, connectivity=8)
+    height, width = page.shape[:2]
+    # White border so windows near the page edge are cropped whole
+    pad_h = max(template.height for template in templates)
+    pad_w = max(template.width for template in templates)
+    padded = cv2.copyMakeBorder(page, pad_h, pad_h, pad_w, pad_w, cv2.BORDER_CONSTANT, value=255)
+
+    for template in templates:
+        h, w = template.height, template.width
+        hits = []
+        for index in range(1, count):
+            x, y, window_w, window_h, _ = stats[index]
+            # Top-left corners that put the template's centre inside the window's box
+            x0, y0 = x - w // 2, y - h // 2
+            crop = padded[y0 + pad_h:y0 + pad_h + window_h + h - 1, x0 + pad_w:x0 + pad_w + window_w + w - 1]
+            res = cv2.matchTemplate(crop, template.image, cv2.TM_CCOEFF_NORMED)
+            # Only this window's positions (another window may reach into its box)
+            res[labels[y:y + window_h, x:x + window_w] != index] = -1
+            hits.extend(((px, py), score) for (px, py), score in response_peaks(res, threshold, top_k, offset=(x0, y0))
+                        if 0 <= px <= width - w and 0 <= py <= height - h)
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        yield template, hits[:top_k]
+
+
+def pair_accidentals(notes, accidentals, clefs, staff_space):
+    """
+    Pair accidentals with the noteheads right of them, then gather the rest found after
+    a clef into its key signature.
+
+    Each accidental goes to at most one notehead and each notehead gets at most one:
+    pairs inside NOTE_WINDOW are taken closest in height first, as match_by_height does
+    within a chord.
+
+    :return: (note_acc, key_sig) as match_accidents.match_acc returns them:
+             [[note, accidental], ...] and the clefs with their 'key_sig'.
+    """
+    accs = [accident_entry(arr) for arr in accidentals]
+    heads = [note_entry(arr) for arr in notes]
+    (left, right), _ = NOTE_WINDOW
+
+    candidates = []
+    for i, acc in enumerate(accs):
+        acc_x, acc_y = acc['loc']
+        for j, head in enumerate(heads):
+            dx, dy = head['loc'][0] - acc_x, abs(head['loc'][1] - acc_y)
+            if -right * staff_space <= dx <= -left * staff_space and dy <= PAIR_HEIGHT * staff_space:
+                candidates.append((dy, dx, i, j))
+    candidates.sort()
+
+    note_acc, paired_accs, paired_heads = [], set(), set()
+    for _, _, i, j in candidates:
+        if i not in paired_accs and j not in paired_heads:
+            note_acc.append([heads[j], accs[i]])
+            paired_accs.add(i)
+            paired_heads.add(j)
+
+    # The rest: key signatures, by the nearest clef whose zone holds them
+    groups = {}
+    for i, acc in enumerate(accs):
+        if i in paired_accs:
+            continue
+        acc_x, acc_y = acc['loc']
+        best = None
+        for k, ((_, y0), (x1, y1), _, _) in enumerate(clefs):
+            if x1 <= acc_x <= x1 + KEY_LENGTH * staff_space and y0 - staff_space <= acc_y <= y1 + staff_space:
+                if best is None or x1 > clefs[best][1][0]:
+                    best = k
+        if best is not None:
+            groups.setdefault(best, []).append(acc)
+
+    key_matches = []
+    for k, group in groups.items():
+        # A key signature is all sharps or all flats: naturals and the minority are dropped
+        labels = [acc['label'] for acc in group if acc['label'] in ('as', 'ab')]
+        if labels:
+            label = max(set(labels), key=labels.count)
+            key_matches.append(([acc for acc in group if acc['label'] == label], clef_entry(clefs[k])))
+
+    return note_acc, get_key_sig(key_matches)
@@ -85,6 +85,8 @@ def detect_staff_lines(image_path, out_path, segment_lenght = 300):
     
     if isinstance(image_path, str):  # Check if image_input is a file path
         binary = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)  # Read image from file path
+    elif image_path.ndim == 2:
+        binary = image_path  # Already single channel
     else:
         binary = cv2.cvtColor(image_path, cv2.COLOR_BGR2GRAY)  # Convert image array to grayscale
 
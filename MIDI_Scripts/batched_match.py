@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+from match_peaks import response_peaks
+
+
+def window_inverse_norm(page, size):
+    """
+    1 / (sqrt(n) * std) of every size (h, w) window of a float32 page, indexed by the
+    window's top-left corner like a matchTemplate result. This is the page half of the
+    TM_CCOEFF_NORMED denominator, the same for every template of that size.
+    """
+    h, w = size
+    height, width = page.shape
+    mean = cv2.boxFilter(page, cv2.CV_32F, (w, h), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+    mean_sq = cv2.sqrBoxFilter(page, cv2.CV_32F, (w, h), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+    variance = cv2.subtract(mean_sq, cv2.multiply(mean, mean))
+    # Flat (blank) windows: a floor of one gray level keeps their scores near 0 instead of noise
+    std = cv2.sqrt(cv2.max(variance, 1.0))
+    return cv2.divide(1.0 / np.sqrt(h * w), std)[:height - h + 1, :width - w + 1]
+
+
+def batched_responses(page, templates):
+    """
+    TM_CCOEFF_NORMED for a whole template set with the page prepared once: the page is
+    converted to float once, and its window statistics are computed once per template
+    size and shared by every template of that size. Each template then costs one plain
+    correlation (TM_CCORR) with its zero-mean version, scaled by the cached statistics.
+    Scores agree with cv2.matchTemplate to about 1e-6 where they matter (>= 0.5).
+
+    :param page: Gray uint8 page.
+    :param templates: template_bank.Template list (uses image, width, height, mean, norm).
+    :return: Generator of (template, response), grouped by template size; response is
+             None for templates larger than the page or without contrast.
+    """
+    page_f = page.astype(np.float32)
+
+    # Same-size templates one after another, so only one size's statistics are held
+    by_size = sorted(templates, key=lambda template: (template.height, template.width))
+    size = inverse_norm = None
+    for template in by_size:
+        if template.height > page.shape[0] or template.width > page.shape[1] or not template.norm:
+            yield template, None
+            continue
+
+        if (template.height, template.width) != size:
+            size = (template.height, template.width)
+            inverse_norm = window_inverse_norm(page_f, size)
+
+        zero_mean = template.image.astype(np.float32) - np.float32(template.mean)
+        res = cv2.matchTemplate(page_f, zero_mean, cv2.TM_CCORR)
+        yield template, cv2.multiply(res, inverse_norm, scale=1.0 / template.norm)
+
+
+def batched_match(page, templates, threshold, top_k=None):
+    """
+    batched_responses reduced to peaks.
+
+    :return: Generator of (template, [((x, y), score), ...]), one peak per blob scoring
+             >= threshold (at most top_k), grouped by template size.
+    """
+    for template, res in batched_responses(page, templates):
+        yield template, [] if res is None else response_peaks(res, threshold, top_k)
@@ -0,0 +1,163 @@
+"""
+Compare the matching engines (matching_engines.py) on a corpus of page images.
+
+Every engine matches every category of main.TEMPLATES_DIRS it is made for on the whole
+page (matching_engines.engine_applies), each run in a fresh process so its peak memory
+can be measured. Engines that need per-page input besides the templates (a windows mask)
+are only run when asked for, and then run without it. Reported per engine: matching
+time, peak memory growth while matching, and agreement with the reference engine on the
+categories it ran: recall (reference matches found) and precision (matches the
+reference also found). A match agrees with another of the same category whose centre
+is within that category's min_distance.
+
+    python benchmark_engines.py page1.png pages_dir/ [--engines pyramid batched]
+                                [--threshold binary=0.9]
+
+Peak memory uses the resource module (Linux and macOS).
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from main import TEMPLATES_DIRS
+from matching_engines import ENGINES, REFERENCE_ENGINE, CONTEXT_ENGINES, match_templates, engine_applies, \
+    standalone_engines
+from page_layout import estimate_staff_spacing
+from page_raster import load_gray
+from template_bank import get_template_bank, staff_scale
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def page_paths(inputs):
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.append(path)
+    return paths
+
+
+def run_engine(page_path, engine, thresholds, top_k):
+    """
+    Match every category on one page with one engine (meant to run in its own process).
+
+    :param thresholds: {category path: threshold} overrides for this engine.
+    :return: (seconds, peak memory growth in MB, {category path: matches})
+    """
+    page = load_gray(page_path)
+    scale = staff_scale(estimate_staff_spacing(page))
+    # Templates decoded and scaled before the clock starts
+    bank = get_template_bank()
+    templates = {category['path']: bank.get(category['path'], scale) for category in TEMPLATES_DIRS}
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    matches = {}
+    for category in TEMPLATES_DIRS:
+        path = category['path']
+        if not engine_applies(engine, path):
+            continue
+        matches[path], _ = match_templates(page, templates[path], thresholds.get(path, category['thresholds']),
+                                           category['min_distance'], engine, top_k)
+    seconds = time.perf_counter() - start
+    return seconds, max(0.0, peak_rss_mb() - baseline), matches
+
+
+def agreement(matches, reference, min_distance):
+    # (reference matches with a match nearby, matches with a reference match nearby)
+    def centres(boxes):
+        return [((x0 + x1) / 2, (y0 + y1) / 2) for (x0, y0), (x1, y1), _, _ in boxes]
+
+    def near(point, points):
+        return any((point[0] - x) ** 2 + (point[1] - y) ** 2 <= min_distance ** 2 for x, y in points)
+
+    found, ref = centres(matches), centres(reference)
+    return sum(near(point, found) for point in ref), sum(near(point, ref) for point in found)
+
+
+def benchmark(paths, engines, threshold_overrides=None, top_k=None):
+    """
+    Run every engine on every page and print per-page and total results.
+
+    :param threshold_overrides: {engine: threshold} applied to every category for that engine.
+    :return: {engine: {'seconds', 'peak_mb', 'matches', 'recall', 'precision'}}
+    """
+    threshold_overrides = threshold_overrides or {}
+    engines = [REFERENCE_ENGINE] + [engine for engine in engines if engine != REFERENCE_ENGINE]
+    for engine in engines:
+        if engine in CONTEXT_ENGINES:
+            print(f"Engine '{engine}' needs per-page input the benchmark does not build; it runs without it")
+    totals = {engine: {'seconds': 0.0, 'peak_mb': 0.0, 'matches': 0, 'reference': 0, 'found': 0, 'agreeing': 0}
+              for engine in engines}
+
+    for path in paths:
+        print(f'\n{os.path.basename(path)}')
+        results = {}
+        for engine in engines:
+            thresholds = {category['path']: threshold_overrides[engine] for category in TEMPLATES_DIRS} \
+                if engine in threshold_overrides else {}
+            # A fresh process per run, so one engine's allocations never count for the next
+            with multiprocessing.Pool(1) as pool:
+                results[engine] = pool.apply(run_engine, (path, engine, thresholds, top_k))
+
+        reference = results[REFERENCE_ENGINE][2]
+        for engine in engines:
+            seconds, peak_mb, matches = results[engine]
+            total = totals[engine]
+            total['seconds'] += seconds
+            total['peak_mb'] = max(total['peak_mb'], peak_mb)
+            for category in TEMPLATES_DIRS:
+                # Only the categories this engine ran on
+                if category['path'] not in matches:
+                    continue
+                found, agreeing = agreement(matches[category['path']], reference[category['path']],
+                                            category['min_distance'])
+                total['matches'] += len(matches[category['path']])
+                total['reference'] += len(reference[category['path']])
+                total['found'] += found
+                total['agreeing'] += agreeing
+            print(f'  {engine:<10} {seconds:7.2f} s  {peak_mb:7.1f} MB  '
+                  f'{sum(len(found) for found in matches.values()):5d} matches')
+
+    report = {}
+    print(f'\nTotal over {len(paths)} page(s), agreement with {REFERENCE_ENGINE}:')
+    for engine, total in totals.items():
+        recall = total['found'] / total['reference'] if total['reference'] else 1.0
+        precision = total['agreeing'] / total['matches'] if total['matches'] else 1.0
+        report[engine] = {'seconds': total['seconds'], 'peak_mb': total['peak_mb'], 'matches': total['matches'],
+                          'recall': recall, 'precision': precision}
+        print(f'  {engine:<10} {total["seconds"]:7.2f} s  {total["peak_mb"]:7.1f} MB peak  '
+              f'{total["matches"]:5d} matches  recall {recall:.3f}  precision {precision:.3f}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare matching engines for speed, memory and agreement')
+    parser.add_argument('pages', nargs='+', help='Page images or directories of them')
+    parser.add_argument('--engines', nargs='+', default=standalone_engines(), choices=sorted(ENGINES),
+                        help='Engines to compare (the reference engine always runs; by default every engine '
+                             'that needs no per-page input besides the templates)')
+    parser.add_argument('--threshold', action='append', default=[], metavar='ENGINE=VALUE',
+                        help='Threshold for every category with one engine, e.g. binary=0.9')
+    parser.add_argument('--top-k', type=int, default=None, help='Most candidates per template')
+    args = parser.parse_args()
+
+    overrides = {}
+    for item in args.threshold:
+        engine, _, value = item.partition('=')
+        overrides[engine] = float(value)
+
+    benchmark(page_paths(args.pages), args.engines, overrides, args.top_k)
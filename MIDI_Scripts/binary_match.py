@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+
+from match_peaks import response_peaks
+from page_raster import BilevelPage, pack_bilevel
+
+
+# Widest template slice read from one 64-bit word: up to 7 bits of the word are spent
+# on the window's offset inside its first byte
+CHUNK_BITS = 56
+
+# Blocks per side of the template for the ink-count bound (mismatch_bound): one per
+# CELL_SIZE pixels, within these limits
+CELL_SIZE = 10
+MIN_CELLS, MAX_CELLS = 3, 6
+
+# Popcount of every byte value, for NumPy versions without np.bitwise_count
+_BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount(words):
+    # Set bits of every uint64
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def row_words(bits):
+    """
+    For every byte of a packed page, the 64 bits starting at it as one big-endian uint64,
+    so the bits of any window row of up to 56 pixels are one shift of one word away.
+    """
+    height, n_bytes = bits.shape
+    padded = np.zeros((height, n_bytes + 7), dtype=np.uint8)
+    padded[:, :n_bytes] = bits
+    words = np.zeros((height, n_bytes), dtype=np.uint64)
+    for k in range(8):
+        words = (words << np.uint64(8)) | padded[:, k:k + n_bytes].astype(np.uint64)
+    return words
+
+
+class BinaryPage:
+    """
+    A bilevel page prepared once for binary matching and shared by every template: the
+    64-bit row words, and the 0/1 ink raster the ink-count bounds are box-filtered from.
+    """
+    def __init__(self, page):
+        if not isinstance(page, BilevelPage):
+            page = pack_bilevel(page)
+        self.shape = page.shape
+        self.words = row_words(page.bits)
+        self.ink = np.unpackbits(page.bits, axis=1, count=page.width)
+
+    def box_ink(self, h, w, depth=cv2.CV_8U):
+        # Ink pixels of every h x w box, indexed by its top-left corner (saturating)
+        return cv2.boxFilter(self.ink, depth, (w, h), anchor=(0, 0), normalize=False,
+                             borderType=cv2.BORDER_CONSTANT)
+
+    def window_bits(self, ys, xs, width):
+        # Row bits of width (<= 56) pixels starting at (xs, ys), as the low bits of uint64s
+        words = self.words[ys, xs >> 3]
+        shift = (xs & 7).astype(np.uint64)
+        return (words << shift) >> np.uint64(64 - width)
+
+
+def mismatch_bound(page, ink, budget):
+    """
+    Lower bound on the mismatch of the template at every position: split it in blocks,
+    and a window differs from it in at least the sum, over the blocks, of the difference
+    in ink count.
+    """
+    h, w = ink.shape
+    height, width = page.shape
+    rows = np.linspace(0, h, int(np.clip(h // CELL_SIZE, MIN_CELLS, MAX_CELLS)) + 1).astype(int)
+    cols = np.linspace(0, w, int(np.clip(w // CELL_SIZE, MIN_CELLS, MAX_CELLS)) + 1).astype(int)
+
+    # Saturating counts and sums only ever lower the bound, so it holds; uint8 halves the
+    # memory traffic whenever the budget fits in it
+    dtype, depth, top = (np.uint8, cv2.CV_8U, 255) if budget < 255 else (np.uint16, cv2.CV_16U, 65535)
+    bound = np.zeros((height - h + 1, width - w + 1), dtype=dtype)
+    boxes = {}
+    for y0, y1 in zip(rows[:-1], rows[1:]):
+        for x0, x1 in zip(cols[:-1], cols[1:]):
+            if y1 == y0 or x1 == x0:
+                continue
+            if (y1 - y0, x1 - x0) not in boxes:
+                boxes[(y1 - y0, x1 - x0)] = page.box_ink(y1 - y0, x1 - x0, depth)
+            box = boxes[(y1 - y0, x1 - x0)][y0:y0 + bound.shape[0], x0:x0 + bound.shape[1]]
+            bound = cv2.add(bound, cv2.absdiff(box, min(top, int(ink[y0:y1, x0:x1].sum()))))
+    return bound
+
+
+def template_rows(ink):
+    """Each row of a 0/1 template as uint64 slices of CHUNK_BITS pixels, shape (chunks, h)."""
+    h, w = ink.shape
+    chunks = []
+    for start in range(0, w, CHUNK_BITS):
+        part = ink[:, start:start + CHUNK_BITS].astype(np.uint64)
+        weights = np.uint64(1) << np.arange(part.shape[1] - 1, -1, -1, dtype=np.uint64)
+        chunks.append((start, part.shape[1], (part * weights).sum(axis=1, dtype=np.uint64)))
+    return chunks
+
+
+def binary_match(page, template, threshold, top_k=None, template_threshold=128):
+    """
+    Hamming similarity (fraction of agreeing pixels) of a binarized template at every
+    position of a bit-packed page. Window rows are XORed with the template rows as
+    64-bit words and the differing bits counted with popcount.
+
+    Positions are only scored where they can reach threshold: ink-count differences of
+    template blocks bound the mismatch first (mismatch_bound), then rows are added a
+    few at a time, dropping positions whose mismatch so far exceeds the budget.
+
+    Hamming scores run higher than TM_CCOEFF_NORMED for the same glyph (a blank window
+    scores 1 - the template's ink ratio), so thresholds are not interchangeable.
+
+    :param page: BinaryPage (or a gray page / BilevelPage, prepared here).
+    :param template: Gray uint8 template; pixels below template_threshold are ink.
+    :return: List of ((x, y), score), one peak per blob scoring >= threshold (at most
+             top_k), best first.
+    """
+    if not isinstance(page, BinaryPage):
+        page = BinaryPage(page)
+
+    ink = (template < template_threshold).astype(np.uint8)
+    h, w = ink.shape
+    height, width = page.shape
+    if height < h or width < w:
+        return []
+
+    budget = int((1 - threshold) * h * w)
+
+    candidates = cv2.findNonZero(cv2.compare(mismatch_bound(page, ink, budget), budget, cv2.CMP_LE))
+    if candidates is None:
+        return []
+    candidates = candidates.reshape(-1, 2).astype(np.intp)
+    xs, ys = candidates[:, 0], candidates[:, 1]
+    mismatch = np.zeros(ys.shape, dtype=np.int32)
+
+    # Spread rows first (0, 4, 8, ..., then 1, 5, ...) so early partial sums prune well
+    order = np.concatenate([np.arange(start, h, 4) for start in range(4)])
+    chunks = template_rows(ink)
+    for done, row in enumerate(order, 1):
+        for start, chunk_width, rows in chunks:
+            bits = page.window_bits(ys + row, xs + start, chunk_width)
+            mismatch += popcount(bits ^ rows[row]).astype(np.int32)
+        if done % 4 == 0 or done == h:
+            keep = mismatch <= budget
+            ys, xs, mismatch = ys[keep], xs[keep], mismatch[keep]
+            if not ys.size:
+                return []
+
+    # Peaks of the scored positions, on a response map just covering them
+    x0, y0 = xs.min(), ys.min()
+    res = np.zeros((ys.max() - y0 + 1, xs.max() - x0 + 1), dtype=np.float32)
+    res[ys - y0, xs - x0] = 1 - mismatch / float(h * w)
+    return response_peaks(res, threshold, top_k, offset=(int(x0), int(y0)))
@@ -0,0 +1,171 @@
+import numpy as np
+
+from page_layout import group_staff_lines
+
+
+# SMuFL code points of the symbols the raster pipeline matches, with the prefix used by
+# the template names (see templates/Core/template_ref.txt) and the glyph bounding box
+# (x_min, y_min, x_max, y_max) in staff spaces from the baseline origin, y up.
+# Boxes come from the Bravura metadata; other SMuFL fonts (Leland, Petaluma, and the
+# SMuFL versions of Emmentaler/Gonville MuseScore ships) are close enough for matching purposes.
+# Only SMuFL fonts are read: LilyPond's own Emmentaler (feta) and Sibelius' Opus or other
+# Sonata-style fonts use other code points, and their pages go through the raster pipeline.
+SMUFL_GLYPHS = {
+    0xE0A4: ('f', 'noteheadBlack', (0.0, -0.5, 1.18, 0.5)),
+    0xE050: ('cg', 'gClef', (0.0, -2.632, 2.684, 4.392)),
+    0xE062: ('cf', 'fClef', (-0.02, -2.54, 2.736, 1.048)),
+    0xE262: ('as', 'accidentalSharp', (0.0, -1.392, 0.996, 1.4)),
+    0xE260: ('ab', 'accidentalFlat', (0.0, -0.7, 0.904, 1.756)),
+    0xE261: ('an', 'accidentalNatural', (0.0, -1.34, 0.672, 1.364)),
+    0xE4E6: ('rq', 'rest8th', (0.0, -1.004, 0.988, 0.696)),
+    0xE4E7: ('rs', 'rest16th', (0.0, -2.0, 1.28, 0.716)),
+}
+
+# Music fonts known not to follow SMuFL (matched by name, case-insensitive), reported by
+# legacy_music_font so rasterized engraved pages are not a silent fallback
+LEGACY_MUSIC_FONTS = ('emmentaler', 'feta', 'opus', 'sonata', 'petrucci', 'maestro')
+
+# Same grouping as main.process_sheet_music uses for its match files
+GLYPH_CATEGORIES = {
+    'f': 'notes',
+    'cg': 'cleffs', 'cf': 'cleffs',
+    'as': 'accidents', 'ab': 'accidents', 'an': 'accidents',
+    'rq': 'rests', 'rs': 'rests',
+}
+
+
+def music_glyphs(page):
+    """
+    Music-font glyphs drawn as text on the page.
+
+    :return: List of (prefix, glyph_name, box, origin, staff_space), all in PDF points.
+    """
+    glyphs = []
+    for span in page.get_texttrace():
+        # SMuFL fonts are laid out with one em = four staff spaces
+        staff_space = span['size'] / 4
+        for ucs, _, origin, _ in span['chars']:
+            if ucs in SMUFL_GLYPHS:
+                prefix, name, box = SMUFL_GLYPHS[ucs]
+                glyphs.append((prefix, name, box, origin, staff_space))
+    return glyphs
+
+
+def is_born_digital(page, min_glyphs=10):
+    # Enough SMuFL symbols as text means the page was engraved, not scanned
+    return len(music_glyphs(page)) >= min_glyphs
+
+
+def legacy_music_font(page):
+    # Name of a non-SMuFL music font drawing text on the page, None without one
+    for span in page.get_texttrace():
+        font = span['font'].split('+')[-1]
+        if any(name in font.lower() for name in LEGACY_MUSIC_FONTS):
+            return font
+    return None
+
+
+def extract_symbols(page, resolution=300):
+    """
+    Symbol matches read straight from the PDF text layer, in pixels at resolution.
+
+    :return: (categories, staff_space) where categories maps 'notes', 'cleffs', 'accidents'
+             and 'rests' to lists in the multi_template_match tuple format
+             ((x_initial, y_initial), (x_final, y_final), score, name).
+    """
+    zoom = resolution / 72
+    categories = {'notes': [], 'cleffs': [], 'accidents': [], 'rests': []}
+    staff_spaces = []
+
+    for prefix, name, (x_min, y_min, x_max, y_max), (ox, oy), staff_space in music_glyphs(page):
+        # PDF y grows downwards once PyMuPDF hands it over, glyph boxes grow upwards
+        start = (int(round((ox + x_min * staff_space) * zoom)), int(round((oy - y_max * staff_space) * zoom)))
+        end = (int(round((ox + x_max * staff_space) * zoom)), int(round((oy - y_min * staff_space) * zoom)))
+        categories[GLYPH_CATEGORIES[prefix]].append((start, end, 1.0, f'{prefix}_{name}'))
+        staff_spaces.append(staff_space * zoom)
+
+    staff_space = float(np.median(staff_spaces)) if staff_spaces else 0
+    return categories, staff_space
+
+
+def _drawing_shapes(page, zoom):
+    # (x0, y0, x1, y1, filled) per stroked segment/rectangle or per filled outline
+    shapes = []
+    for path in page.get_drawings():
+        half_width = (path.get('width') or 0) * zoom / 2
+        if path.get('fill') is not None:
+            rect = path['rect']
+            shapes.append((rect.x0 * zoom, rect.y0 * zoom, rect.x1 * zoom, rect.y1 * zoom, True))
+            continue
+        for item in path['items']:
+            if item[0] == 'l':
+                p1, p2 = item[1], item[2]
+                x0, x1 = sorted((p1.x * zoom, p2.x * zoom))
+                y0, y1 = sorted((p1.y * zoom, p2.y * zoom))
+            elif item[0] == 're':
+                rect = item[1]
+                x0, y0, x1, y1 = rect.x0 * zoom, rect.y0 * zoom, rect.x1 * zoom, rect.y1 * zoom
+            else:
+                continue
+            # Stroke width makes zero-height lines as thick as they are drawn
+            if x1 - x0 < y1 - y0:
+                x0, x1 = x0 - half_width, x1 + half_width
+            else:
+                y0, y1 = y0 - half_width, y1 + half_width
+            shapes.append((x0, y0, x1, y1, False))
+    return shapes
+
+
+def extract_lines(page, staff_space, resolution=300):
+    """
+    Staff lines, stems/barlines, beams and ledger lines from the page's vector drawings,
+    in pixels at resolution and in the formats of the raster detectors:
+
+        'staff_lines' - std_staff:        [((x1, y), (x2, y)), ...] sorted by y
+        'stems'       - contour_stem:     [((x_mid, top), (x_mid, bottom)), ...]
+        'bars'        - contour_notebar:  [((left, y_mid), (right, y_mid)), ...]
+        'centroids'   - find_centroids:   [(x, y), ...] of ledger lines, sorted by y
+    """
+    zoom = resolution / 72
+    thin = 0.3 * staff_space
+
+    staff_segments = []
+    ledgers = []
+    stems = []
+    bars = []
+    for x0, y0, x1, y1, filled in _drawing_shapes(page, zoom):
+        width, height = x1 - x0, y1 - y0
+        y_mid = int(round((y0 + y1) / 2))
+        x_mid = int(round((x0 + x1) / 2))
+
+        if height <= thin and width > height:
+            if width >= 8 * staff_space:
+                staff_segments.append((x0, y_mid, x1))
+            elif width <= 4 * staff_space:
+                ledgers.append((x_mid, y_mid))
+        elif width <= thin and height >= staff_space:
+            stems.append(((x_mid, int(round(y0))), (x_mid, int(round(y1)))))
+        elif filled and width >= staff_space and height <= 3 * staff_space:
+            bars.append(((int(round(x0)), y_mid), (int(round(x1)), y_mid)))
+
+    # Staff lines are often drawn one segment per measure: join those sharing a row
+    merged = {}
+    for x0, y, x1 in staff_segments:
+        key = next((k for k in merged if abs(k - y) <= thin), y)
+        left, right = merged.get(key, (x0, x1))
+        merged[key] = (min(left, x0), max(right, x1))
+    staff_lines = sorted((((int(round(x0)), y), (int(round(x1)), y)) for y, (x0, x1) in merged.items()),
+                         key=lambda line: line[0][1])
+
+    # Ledger lines are the short horizontal lines outside every staff
+    staves = group_staff_lines([line[0][1] for line in staff_lines])
+    centroids = sorted((c for c in ledgers if not any(s[0] - thin <= c[1] <= s[-1] + thin for s in staves)),
+                       key=lambda c: c[1])
+
+    return {'staff_lines': staff_lines, 'stems': stems, 'bars': bars, 'centroids': centroids}
+
+
+def staff_groups(staff_lines):
+    # Five-line staves as main_lines returns them: [[y1, ..., y5], ...] top to bottom
+    staves = group_staff_lines([line[0][1] for line in staff_lines])
+    return [[int(y) for y in staff] for staff in staves if len(staff) == 5]
@@ -0,0 +1,139 @@
+"""
+Where clefs (and so key signatures) can be: at the start of every staff and next to its
+barlines. Staves come from page_layout.find_staves and barlines from
+get_barlines_v3.get_barline, both before any template matching, so the clef
+categories are matched only inside these zones ('windows' engine) instead of over
+every staff band.
+
+Zones are in staff spaces, for the centre of a clef's match box.
+"""
+import cv2
+import numpy as np
+
+from get_barlines_v3 import get_barline
+
+
+# Clef centre after the start of the staff lines
+START_ZONE = (0.0, 4.0)
+
+# Clef centre around a barline: clef changes are engraved before it, some after it
+BARLINE_ZONE = (-3.0, 4.0)
+
+# Clef centre above the top and below the bottom staff line
+ZONE_MARGIN = 1.0
+
+# Width of the slabs (staff spaces) over which the staff lines of a skewed or curved
+# scan are taken as straight
+SLAB = 8.0
+
+
+def top_line(lines, spacing):
+    """
+    Row of the top of five evenly spaced lines in an image of long horizontal runs:
+    where five rows one staff space apart hold the most thin ink (a comb fit on the row
+    profile, each row with its neighbours). Beams are long runs too, but thicker than
+    a third of a staff space. None without lines.
+    """
+    beams = cv2.morphologyEx(lines, cv2.MORPH_OPEN,
+                             cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(3, int(round(spacing / 3))))))
+    thin = cv2.bitwise_and(lines, cv2.bitwise_not(beams))
+
+    near = max(1, int(round(spacing / 8)))
+    profile = np.convolve(np.count_nonzero(thin, axis=1), np.ones(2 * near + 1), 'same')
+    offsets = np.round(np.arange(5) * spacing).astype(int)
+    if len(profile) <= offsets[-1] or not profile.any():
+        return None
+    tops = np.arange(len(profile) - offsets[-1])
+    return int(tops[np.argmax(profile[tops[:, None] + offsets].sum(axis=1))])
+
+
+def staff_geometry(binary, staff, spacing):
+    """
+    Where a staff's lines are, slab by slab, from the long horizontal runs around
+    find_staves' rows (which may include beam or ledger rows, or miss a line).
+
+    :return: (start, slabs): the column the lines begin at (a brace, bracket or text
+             left of the staff has no long runs) and (x0, x1, top, bottom) of every
+             SLAB-wide slab from it on holding lines.
+    """
+    y0 = max(0, int(staff[0] - spacing))
+    band = binary[y0:int(staff[-1] + spacing) + 1]
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, int(round(4 * spacing))), 1))
+    lines = cv2.morphologyEx(band, cv2.MORPH_OPEN, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+
+    inked = np.count_nonzero(lines, axis=0) >= 3
+    start = int(np.argmax(inked)) if inked.any() else 0
+
+    height = int(round(4 * spacing))
+    width = max(1, int(round(SLAB * spacing)))
+    slabs = []
+    for x0 in range(start, band.shape[1], width):
+        top = top_line(lines[:, x0:x0 + width], spacing)
+        if top is not None:
+            slabs.append((x0, min(x0 + width, band.shape[1]), y0 + top, y0 + top + height))
+    return start, slabs
+
+
+def barline_columns(binary, slabs, spacing):
+    """
+    x of the barline candidates of a staff: thin runs of columns inked from its top line
+    to its bottom line and stopping at one of them. Touching notes or slurs do not
+    matter column by column.
+
+    :return: (x, top, bottom) of every candidate.
+    """
+    near = max(1, int(round(spacing / 8)))
+    found = []
+    for x0, x1, top, bottom in slabs:
+        band = binary[max(0, top - near):bottom + near + 1, x0:x1]
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, bottom - top - 2 * near)))
+        # (a blank border: the default one counts as ink, making runs that touch the band's edge full)
+        full = cv2.morphologyEx(band, cv2.MORPH_OPEN, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        columns = np.nonzero(np.count_nonzero(full, axis=0))[0]
+        # Adjacent columns are one barline; wider runs are chords stacked across the staff
+        for run in np.split(columns, np.nonzero(np.diff(columns) > 1)[0] + 1):
+            if not 0 < run.size <= spacing / 3:
+                continue
+            # A stem across the whole staff goes on past both ends, to its notehead and its
+            # beam; a barline stops at the top or the bottom line (at both without a grand staff)
+            c0, c1 = x0 + run[0], x0 + run[-1] + 1
+            above = binary[max(0, top - int(spacing / 2)):max(0, top - 2 * near), c0:c1]
+            below = binary[bottom + 2 * near:bottom + int(spacing / 2), c0:c1]
+            if not above.any() or not below.any():
+                found.append((int(x0 + run.mean()), top, bottom))
+    return found
+
+
+def staff_barlines(binary, gray, geometry, spacing, output_directory):
+    """
+    Barlines of every staff: its barline_columns, as lines standardized by get_barline.
+
+    :param geometry: staff_geometry of every staff.
+    :return: One list of barline x positions per staff.
+    """
+    candidates = [barline_columns(binary, slabs, spacing) for _, slabs in geometry]
+    lines = [((x, top), (x, bottom)) for found in candidates for x, top, bottom in found]
+    barlines = {x0 for (x0, _), _ in get_barline(lines, gray, output_directory, min_length = 3 * spacing)}
+    return [sorted(x for x, _, _ in found if x in barlines) for found in candidates]
+
+
+def clef_zones(gray, staves, spacing, output_directory):
+    """
+    Mask (uint8, 255 inside) of the page positions where a clef's centre may be: the
+    START_ZONE of every staff and the BARLINE_ZONE of its barlines, over the staff's
+    height plus ZONE_MARGIN.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    geometry = [staff_geometry(binary, staff, spacing) for staff in staves]
+
+    zones = np.zeros(gray.shape[:2], dtype=np.uint8)
+    for (start, slabs), barlines in zip(geometry, staff_barlines(binary, gray, geometry, spacing, output_directory)):
+        if not slabs:
+            continue
+        top = min(slab[2] for slab in slabs) - ZONE_MARGIN * spacing
+        bottom = max(slab[3] for slab in slabs) + ZONE_MARGIN * spacing
+        spans = [(start + START_ZONE[0] * spacing, start + START_ZONE[1] * spacing)]
+        spans += [(x + BARLINE_ZONE[0] * spacing, x + BARLINE_ZONE[1] * spacing) for x in barlines]
+        for x0, x1 in spans:
+            cv2.rectangle(zones, (int(x0), int(top)), (int(x1), int(bottom)), 255, -1)
+    return zones
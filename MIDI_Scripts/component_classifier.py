@@ -0,0 +1,241 @@
+"""
+Symbol recognition by connected components instead of template sliding.
+
+The page is binarized and its staff lines removed, every connected component gets a
+small fixed-size feature vector (size in staff spaces, fill ratio and an 8x8 thumbnail
+of its ink) and a random forest trained on the templates/Core images labels it with one
+of main.TEMPLATES_DIRS' categories or 'other'. The cost grows with the number of
+symbols on the page, not with pixels x templates.
+
+Recall is well below template matching's. On a dense skewed piano scan it found, of the
+symbols template matching found: 330/591 noteheads (chords and noteheads touching
+other noteheads merge), 12/17 clefs (4 of 10 system-start clefs are missed: bits of
+staff line left on them lower their confidence), 49/99 accidentals and 9/10 rests. A
+missed system-start clef puts every pitch of its staff wrong further on.
+
+Train and save the model (also done on first use, and whenever a template changes):
+
+    python component_classifier.py [model_path]
+"""
+import argparse
+import os
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from page_layout import vertical_run_modes
+from template_bank import TEMPLATES_ROOT, IMAGE_EXTENSIONS, TEMPLATE_STAFF_SPACE
+
+
+DEFAULT_MODEL = os.path.join(TEMPLATES_ROOT, 'components.model.joblib')
+
+# Label of the components that are none of the categories
+OTHER = 'other'
+
+THUMBNAIL = 8
+
+# Components outside these heights (staff spaces) are never symbols
+MIN_HEIGHT, MAX_HEIGHT = 0.4, 9.0
+
+
+def remove_staff_lines(binary, thickness, length):
+    """
+    Ink (255) without the staff and ledger lines: pixels on horizontal runs at least
+    length long whose vertical run is at most the line thickness (plus one). Noteheads,
+    stems and other strokes crossing a line keep their pixels on it.
+    """
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                  cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, int(length)), 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (1, int(thickness) + 2)))
+    lines = cv2.bitwise_and(horizontal, cv2.bitwise_not(vertical))
+    return cv2.bitwise_and(binary, cv2.bitwise_not(lines))
+
+
+def component_features(ink, staff_space):
+    """Feature vector of one component's 0/1 ink crop: height, width (staff spaces), fill, thumbnail."""
+    h, w = ink.shape
+    thumbnail = cv2.resize(ink.astype(np.float32), (THUMBNAIL, THUMBNAIL), interpolation=cv2.INTER_AREA)
+    return np.concatenate([[h / staff_space, w / staff_space, ink.mean()], thumbnail.ravel()])
+
+
+def template_ink(image, staff_space=TEMPLATE_STAFF_SPACE):
+    # The template's symbol as a 0/1 crop: lines removed, largest component kept
+    _, binary = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    binary = remove_staff_lines(binary, max(1, round(0.15 * staff_space)), min(staff_space, 0.8 * image.shape[1]))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if count < 2:
+        return None
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    x, y, w, h = stats[largest, :4]
+    return (labels[y:y + h, x:x + w] == largest).astype(np.uint8)
+
+
+def synthetic_others(staff_space=TEMPLATE_STAFF_SPACE):
+    # Shapes no category template shows: stems, beams, dots, barline pieces
+    shapes = []
+    s = staff_space
+    for length in (2, 3, 3.5, 4, 6):
+        shapes.append(np.ones((int(length * s), max(1, round(0.15 * s))), np.uint8))
+    for length in (2, 4, 8):
+        for slope in (0, 0.15, 0.3):
+            beam = np.zeros((int(0.5 * s + slope * length * s) + 1, int(length * s)), np.uint8)
+            cv2.line(beam, (0, beam.shape[0] - int(0.25 * s) - 1), (beam.shape[1] - 1, int(0.25 * s)), 1,
+                     max(1, int(0.5 * s)))
+            shapes.append(beam)
+    dot = np.zeros((int(0.4 * s), int(0.4 * s)), np.uint8)
+    cv2.circle(dot, (dot.shape[1] // 2, dot.shape[0] // 2), dot.shape[0] // 2, 1, -1)
+    shapes.append(dot)
+    return shapes
+
+
+def category_label(templates_dir, files):
+    """
+    A category's label, the template-name prefix the later stages read ('f', 'cg', 'ab',
+    ...; see match_accidents and NoteModifiers) followed by '_component'.
+    """
+    prefixes = Counter(name.split('_')[0] for name in files)
+    return prefixes.most_common(1)[0][0] + '_component' if prefixes else templates_dir
+
+
+def training_set(categories, templates_root=TEMPLATES_ROOT):
+    """
+    (features, labels, {label: category path}) from every image under templates_root/Core:
+    images of the categories get their label, all other images (stems, beams, braces,
+    staff ends...) and the synthetic shapes are OTHER. Each image is also added shrunk,
+    enlarged, thinned and thickened.
+    """
+    roots = {os.path.normpath(os.path.join(templates_root, path)): path for path in categories}
+    samples, labels, label_paths = [], [], {}
+    for directory, _, files in sorted(os.walk(os.path.join(templates_root, 'Core'))):
+        images = sorted(f for f in files if f.endswith(IMAGE_EXTENSIONS))
+        path = roots.get(os.path.normpath(directory))
+        label = category_label(path, images) if path else OTHER
+        if path:
+            label_paths[label] = path
+        for name in images:
+            image = cv2.imread(os.path.join(directory, name), cv2.IMREAD_GRAYSCALE)
+            ink = template_ink(image) if image is not None else None
+            if ink is not None:
+                samples.append(ink)
+                labels.append(label)
+    samples += synthetic_others()
+    labels += [OTHER] * (len(samples) - len(labels))
+
+    features, targets = [], []
+    kernel = np.ones((2, 2), np.uint8)
+    for ink, label in zip(samples, labels):
+        for scale in (0.9, 1.0, 1.1):
+            scaled = cv2.resize(ink, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+            for variant in (scaled, cv2.erode(scaled, kernel), cv2.dilate(scaled, kernel)):
+                if variant.any():
+                    features.append(component_features(variant, TEMPLATE_STAFF_SPACE * scale))
+                    targets.append(label)
+    return np.array(features), np.array(targets), label_paths
+
+
+def train_classifier(categories, model_path=DEFAULT_MODEL, templates_root=TEMPLATES_ROOT):
+    """Train the random forest on the templates and save it with joblib."""
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+
+    features, labels, label_paths = training_set(categories, templates_root)
+    model = RandomForestClassifier(n_estimators=100, class_weight='balanced', random_state=0)
+    model.fit(features, labels)
+    joblib.dump({'model': model, 'paths': label_paths}, model_path)
+    print(f'Trained component classifier on {len(labels)} samples, {len(set(labels))} classes: {model_path}')
+    return {'model': model, 'paths': label_paths}
+
+
+_default_classifier = None
+
+
+def get_component_classifier(categories, model_path=DEFAULT_MODEL):
+    # Saved model when it is newer than every template, retrained (and saved) otherwise
+    global _default_classifier
+    if _default_classifier is None:
+        import joblib
+        from template_pack import pack_is_current
+        if pack_is_current(model_path):
+            _default_classifier = joblib.load(model_path)
+        else:
+            _default_classifier = train_classifier(categories, model_path)
+    return _default_classifier
+
+
+def classify_components(gray, staff_space, categories, classifier=None, min_confidence=0.6):
+    """
+    Label the connected components of a page.
+
+    :param categories: Category paths to recognise (main.TEMPLATES_DIRS paths).
+    :param min_confidence: Lowest class probability accepted; less confident components
+                           count as OTHER.
+    :return: {category path: [((x0, y0), (x1, y1), confidence, label), ...]} in the
+             multi_template_match format, best first.
+    """
+    if classifier is None:
+        classifier = get_component_classifier(categories)
+    model, label_paths = classifier['model'], classifier['paths']
+
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    thickness, _ = vertical_run_modes(binary)
+    binary = remove_staff_lines(binary, thickness, 2 * staff_space)
+
+    # Noteheads are joined to their stems and beams; without strokes thinner than a third
+    # of a staff space they stand alone, so they are looked for on that image instead
+    note_paths = [path for path in categories if 'Notes_Full' in path]
+    no_stems = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, int(round(staff_space / 3))), 1)))
+
+    # System-start clefs stay joined to the system's barline or brace by the bits of staff
+    # line the removal leaves (on skewed scans above all); without vertical strokes as long
+    # as a staff is high (barlines, brace and long stems) they stand alone
+    long_strokes = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                    cv2.getStructuringElement(cv2.MORPH_RECT, (1, int(round(4 * staff_space)))),
+                                    borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    no_barlines = cv2.bitwise_and(binary, cv2.bitwise_not(long_strokes))
+
+    results = {path: [] for path in categories}
+    passes = [(no_barlines, [path for path in categories if path not in note_paths]), (no_stems, note_paths)]
+    for image, paths in passes:
+        if not paths:
+            continue
+        boxes, features = component_boxes(image, staff_space)
+        if not features:
+            continue
+        probabilities = model.predict_proba(np.array(features))
+        for box, row in zip(boxes, probabilities):
+            best = int(np.argmax(row))
+            label = model.classes_[best]
+            if label == OTHER or row[best] < min_confidence or label_paths.get(label) not in paths:
+                continue
+            results[label_paths[label]].append(box + (float(row[best]), str(label)))
+
+    for matches in results.values():
+        matches.sort(key=lambda match: match[2], reverse=True)
+    return results
+
+
+def component_boxes(binary, staff_space):
+    # Bounding boxes and feature vectors of the symbol-sized components of a binary image
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    boxes, features = [], []
+    for index in range(1, count):
+        x, y, w, h, _ = stats[index]
+        if not MIN_HEIGHT * staff_space <= h <= MAX_HEIGHT * staff_space:
+            continue
+        ink = (labels[y:y + h, x:x + w] == index).astype(np.uint8)
+        boxes.append(((int(x), int(y)), (int(x + w), int(y + h))))
+        features.append(component_features(ink, staff_space))
+    return boxes, features
+
+
+if __name__ == '__main__':
+    from main import TEMPLATES_DIRS
+
+    parser = argparse.ArgumentParser(description='Train the connected-component symbol classifier')
+    parser.add_argument('model_path', nargs='?', default=DEFAULT_MODEL)
+    args = parser.parse_args()
+
+    train_classifier([category['path'] for category in TEMPLATES_DIRS], args.model_path)
@@ -1,22 +1,368 @@
 import fitz  # PyMuPDF
+import cv2
+import numpy as np
 import os
 import sys
 import time
+import collections
 
 import multiprocessing
 
+from page_layout import find_staves, staff_bands, identity_map, has_staves, content_bbox, crop_to_content, \
+    stack_strips
+from raster_cache import RasterCache, pdf_digest
+from page_raster import BilevelPage, pack_bilevel
+from born_digital import is_born_digital
+
+# Document handle kept open for the lifetime of a pool worker
+_worker_doc = None
+# Raster cache and PDF content hash shared by the worker's pages
+_worker_cache = None
+_worker_digest = None
+
+def _init_worker(pdf_path, cache=None, digest=None):
+    global _worker_doc, _worker_cache, _worker_digest
+    _worker_doc = fitz.open(pdf_path)
+    _worker_cache = cache
+    _worker_digest = digest
+
+# Native scan resolutions further than this (relative) from the requested one are resampled
+RESAMPLE_TOLERANCE = 0.1
+
+# Longest page side (points) up to which a page box is taken as the paper size (17 in,
+# tabloid/A3). Scans often come on boxes sized one point per pixel: their DPI means nothing
+MAX_PAPER_POINTS = 17 * 72
+
+def extract_page_pixmap(doc, page_num, min_coverage=0.9, max_aspect_error=0.01):
+    """
+    Return the page's embedded scan as a gray, alpha-free Pixmap at its native resolution,
+    or None when the page is not a single upright image covering (almost) all of it, or
+    when its pixels are not square (fax-style scans, e.g. 204x98 DPI, differing by more than
+    max_aspect_error): those are rendered instead.
+    Bilevel JBIG2/CCITT scans come out as 8-bit gray holding only 0 and 255.
+    """
+    page = doc.load_page(page_num)
+    images = page.get_images(full=True)
+    if len(images) != 1 or page.rotation:
+        return None
+
+    xref, smask = images[0][0], images[0][1]
+    if smask:
+        return None     # Soft-masked images need compositing, leave them to the renderer
+
+    placements = page.get_image_rects(xref, transform=True)
+    if len(placements) != 1:
+        return None
+    rect, matrix = placements[0]
+
+    # Only plain scaling: rotated or flipped placements would need resampling anyway
+    if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+        return None
+    if (rect & page.rect).get_area() < min_coverage * page.rect.get_area():
+        return None
+
+    pix = fitz.Pixmap(doc, xref)
+    # Pixels per point across and down
+    scale_x, scale_y = pix.width / matrix.a, pix.height / matrix.d
+    if abs(scale_x - scale_y) > max_aspect_error * max(scale_x, scale_y):
+        return None
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)   # Drop alpha
+    if pix.n != 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    return pix
+
+def pixmap_to_gray(pix):
+    # samples_mv dies with the pixmap, so take the one copy MuPDF hands out
+    # and build the array on top of that buffer without copying again
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return gray[:, :pix.width]
+
+def extract_page_gray(doc, page_num, resolution=None):
+    """
+    Embedded scan of a single-image page as a uint8 array, with its placement offset on
+    the page (in the image's own pixels) and its native DPI.
+    With resolution, a scan whose native DPI is further than RESAMPLE_TOLERANCE from it is
+    resampled to it (offset and DPI follow): the pixel constants after template matching
+    (morphology kernels, barline lengths, accidental distances) assume that resolution.
+    Only on paper-sized pages (MAX_PAPER_POINTS); on larger boxes the scan is kept as it is.
+    (None, None, None) when the page must be rendered instead.
+    """
+    pix = extract_page_pixmap(doc, page_num)
+    if pix is None:
+        return None, None, None
+
+    page = doc.load_page(page_num)
+    rect = page.get_image_rects(page.get_images(full=True)[0][0])[0]
+    scale = pix.width / rect.width
+    gray = pixmap_to_gray(pix)
+    paper = max(page.rect.width, page.rect.height) <= MAX_PAPER_POINTS
+    if resolution and paper and abs(72 * scale / resolution - 1) > RESAMPLE_TOLERANCE:
+        factor = resolution / (72 * scale)
+        gray = cv2.resize(gray, None, fx=factor, fy=factor,
+                          interpolation=cv2.INTER_AREA if factor < 1 else cv2.INTER_CUBIC)
+        scale = resolution / 72
+    offset = (int(round((rect.x0 - page.rect.x0) * scale)), int(round((rect.y0 - page.rect.y0) * scale)))
+    return gray, offset, 72 * scale
+
 def convert_page(pdf_path, page_num, name, resolution, outpath):
-    doc = fitz.open(pdf_path)  # Open the PDF here to ensure it's local to the process
+    # Reuse the worker's document when the pool opened one, otherwise open it locally
+    doc = _worker_doc if _worker_doc is not None else fitz.open(pdf_path)
     zoom = resolution / 72
     mat = fitz.Matrix(zoom, zoom)
     page = doc.load_page(page_num)  # Load the page
-    pix = page.get_pixmap(matrix=mat)  # Render the page
     output_image_path = os.path.join(outpath, f'{name}_p_{page_num}.png')
-    pix.save(output_image_path)
-    doc.close()  # Close the document to free up the resource
+    if _worker_cache is not None:
+        # Cached pages are written straight from the stored raster, whole like the viewer expects
+        gray, _ = cached_render_page(doc, page_num, resolution, cache=_worker_cache, digest=_worker_digest,
+                                     crop=False)
+        cv2.imwrite(output_image_path, gray)
+    else:
+        # Scanned pages keep their embedded image; anything else is rendered.
+        # Either way the PNG is 8-bit gray without alpha, a third of an RGB page
+        pix = extract_page_pixmap(doc, page_num) or page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+        pix.save(output_image_path)
+    if doc is not _worker_doc:
+        doc.close()  # Close the document to free up the resource
     # print(f'Converted page {page_num}')
 
-def convert_pdf_to_png(pdf_path, pages_arg, resolution=300, outpath=None):
+def render_page_gray(doc, page_num, resolution=300, clip=None):
+    """
+    Render a page of an open document to a single-channel uint8 array (H, W).
+    No PNG is written; the array can go straight into process_sheet_music.
+    clip (fitz.Rect, in page points) limits rendering to that part of the page.
+    """
+    zoom = resolution / 72
+    mat = fitz.Matrix(zoom, zoom)
+    page = doc.load_page(page_num)
+    pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    return pixmap_to_gray(pix)
+
+def is_music_page(doc, page_num, check_resolution=40):
+    """
+    Staff-presence pre-check on a low resolution render, cheap enough to run on every
+    page before matching. Title pages, prefaces, critical notes and blank pages fail it.
+    """
+    return has_staves(render_page_gray(doc, page_num, check_resolution))
+
+def content_clip(doc, page_num, layout, layout_resolution, margin=8):
+    """
+    Inked content of a page as a fitz.Rect in page points, found on its layout render.
+    margin is in layout pixels. None for a blank page.
+    """
+    bbox = content_bbox(layout, margin)
+    if bbox is None:
+        return None
+    page_rect = doc.load_page(page_num).rect
+    to_points = 72 / layout_resolution
+    x0, y0, x1, y1 = bbox
+    return fitz.Rect(page_rect.x0 + x0 * to_points, page_rect.y0 + y0 * to_points,
+                     page_rect.x0 + x1 * to_points, page_rect.y0 + y1 * to_points) & page_rect
+
+def render_page_cropped(doc, page_num, resolution=300, layout_resolution=50):
+    """
+    Render only the inked part of a page, located on a cheap layout_resolution render.
+    Returns (gray, page_map) with the crop's offset on the full-resolution page.
+    """
+    layout = render_page_gray(doc, page_num, layout_resolution)
+    clip = content_clip(doc, page_num, layout, layout_resolution, margin=2)
+    if clip is None:
+        gray = render_page_gray(doc, page_num, resolution)
+        return gray, identity_map(gray)
+
+    page_rect = doc.load_page(page_num).rect
+    zoom = resolution / 72
+    gray = render_page_gray(doc, page_num, resolution, clip=clip)
+    src_x = int(round((clip.x0 - page_rect.x0) * zoom))
+    src_y = int(round((clip.y0 - page_rect.y0) * zoom))
+    return gray, [(0, src_y, gray.shape[0], src_x)]
+
+def render_page_strips(doc, page_num, resolution=300, layout_resolution=72, ledger_margin=4):
+    """
+    Two-resolution render: find the staves on a cheap layout_resolution render, then
+    render only the staff-system strips at full resolution and stack them top to bottom.
+
+    Returns (gray, page_map). page_map lists (dst_y, src_y, height, src_x) strips that
+    place the stacked rows back on the full-resolution page (see page_layout.to_page_coords).
+    Pages without staves fall back to a plain full-page render.
+    """
+    layout = render_page_gray(doc, page_num, layout_resolution)
+    staves, spacing = find_staves(layout)
+    if not staves:
+        gray = render_page_gray(doc, page_num, resolution)
+        return gray, identity_map(gray)
+
+    bands = staff_bands(staves, spacing, layout.shape[0], ledger_margin)
+
+    page_rect = doc.load_page(page_num).rect
+    to_points = 72 / layout_resolution
+    zoom = resolution / 72
+
+    # Strips span the inked columns only, not the side margins
+    content = content_clip(doc, page_num, layout, layout_resolution, margin=2) or page_rect
+    src_x = int(round((content.x0 - page_rect.x0) * zoom))
+
+    strips = []
+    for y_start, y_end in bands:
+        clip = fitz.Rect(content.x0, page_rect.y0 + y_start * to_points,
+                         content.x1, page_rect.y0 + y_end * to_points)
+        strip = render_page_gray(doc, page_num, resolution, clip=clip)
+        strips.append((strip, int(round(y_start * to_points * zoom)), src_x))
+
+    return stack_strips(strips, gap=int(round(2 * spacing * resolution / layout_resolution)))
+
+def scan_strips(gray, offset, native_resolution, layout_resolution=72, ledger_margin=4):
+    """
+    render_page_strips for an extracted scan: staves are found on a downscaled copy and
+    the staff-system strips are sliced from the native-resolution image.
+    """
+    factor = layout_resolution / native_resolution
+    layout = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    staves, spacing = find_staves(layout)
+    if not staves:
+        return gray, [(0, offset[1], gray.shape[0], offset[0])]
+
+    # Strips span the inked columns only, not the side margins
+    bbox = content_bbox(layout, margin=2)
+    x_start, x_end = (int(bbox[0] / factor), min(gray.shape[1], int(np.ceil(bbox[2] / factor)))) if bbox else \
+        (0, gray.shape[1])
+
+    strips = []
+    for y_start, y_end in staff_bands(staves, spacing, layout.shape[0], ledger_margin):
+        y_start, y_end = int(y_start / factor), min(gray.shape[0], int(np.ceil(y_end / factor)))
+        strips.append((gray[y_start:y_end, x_start:x_end], y_start + offset[1], x_start + offset[0]))
+
+    return stack_strips(strips, gap=int(round(2 * spacing / factor)))
+
+def render_page(doc, page_num, resolution=300, layout_resolution=None, extract_images=True, crop=True):
+    """
+    Page raster and its page_map. Single-image scans are pulled out at their native
+    resolution, or resampled to resolution when far from it (extract_page_gray); everything
+    else is rendered at resolution.
+    With layout_resolution set, only the staff-system strips are kept.
+    With crop, blank margins are left out; page_map holds the offset of what is kept.
+    """
+    if extract_images:
+        gray, offset, native_resolution = extract_page_gray(doc, page_num, resolution)
+        if gray is not None:
+            if layout_resolution:
+                return scan_strips(gray, offset, native_resolution, layout_resolution)
+            if crop:
+                return crop_to_content(gray, offset)
+            return gray, [(0, offset[1], gray.shape[0], offset[0])]
+
+    if layout_resolution:
+        return render_page_strips(doc, page_num, resolution, layout_resolution)
+    if crop:
+        return render_page_cropped(doc, page_num, resolution)
+    gray = render_page_gray(doc, page_num, resolution)
+    return gray, identity_map(gray)
+
+def render_page_mode(doc, page_num, resolution=300, layout_resolution=None, bilevel=False, crop=True):
+    # render_page, optionally packed to one bit per pixel (page_raster.BilevelPage)
+    gray, page_map = render_page(doc, page_num, resolution, layout_resolution, crop=crop)
+    if bilevel:
+        return pack_bilevel(gray), page_map
+    return gray, page_map
+
+def cached_render_page(doc, page_num, resolution=300, layout_resolution=None, cache=None, digest=None,
+                       bilevel=False, crop=True):
+    """
+    render_page_mode through a RasterCache: digest is the PDF content hash (raster_cache.pdf_digest).
+    Without a cache this is render_page_mode.
+    """
+    if cache is None:
+        return render_page_mode(doc, page_num, resolution, layout_resolution, bilevel, crop)
+
+    variant = f'layout{layout_resolution}' if layout_resolution else ('crop' if crop else 'full')
+    colorspace = 'bilevel' if bilevel else 'gray'
+    hit = cache.get(digest, page_num, resolution, colorspace, variant)
+    # (bit-packed entries cached without their width are rendered again, so a hit has
+    # the same shape as a fresh render)
+    if hit is not None and not (bilevel and hit[2] is None):
+        raster, page_map, width = hit
+        return (BilevelPage(raster, width) if bilevel else raster), page_map
+
+    raster, page_map = render_page_mode(doc, page_num, resolution, layout_resolution, bilevel, crop)
+    if bilevel:
+        cache.put(digest, page_num, resolution, raster.bits, page_map, colorspace, variant, width=raster.width)
+    else:
+        cache.put(digest, page_num, resolution, raster, page_map, colorspace, variant)
+    return raster, page_map
+
+def page_kind(doc, page_num, vector=True, check_resolution=40):
+    """
+    How a page is recognized: 'vector' when it is born-digital and read from its glyphs
+    (born_digital.is_born_digital), 'skip' when it fails the staff-presence check
+    (is_music_page; check_resolution None keeps every page), None when it is rendered.
+    """
+    if vector and is_born_digital(doc.load_page(page_num)):
+        return 'vector'
+    if check_resolution and not is_music_page(doc, page_num, check_resolution):
+        return 'skip'
+    return None
+
+def checked_render_page(doc, page_num, resolution, layout_resolution, cache, digest, bilevel, page_filter=None):
+    # (page_num, raster, page_map), or (page_num, None, kind) for a page page_filter turns down
+    kind = page_filter(doc, page_num) if page_filter is not None else None
+    if kind is not None:
+        return page_num, None, kind
+    return (page_num,) + cached_render_page(doc, page_num, resolution, layout_resolution, cache, digest, bilevel)
+
+def _render_worker(args):
+    page_num, resolution, layout_resolution, bilevel, page_filter = args
+    return checked_render_page(_worker_doc, page_num, resolution, layout_resolution, _worker_cache, _worker_digest,
+                               bilevel, page_filter)
+
+def convert_pdf_to_arrays(pdf_path, pages_arg, resolution=300, processes=None, layout_resolution=None, cache=None,
+                          bilevel=False, max_pending=None, page_filter=None):
+    """
+    Yield (page_num, gray_array, page_map) for the requested pages, in page order.
+    Each worker opens the PDF once and renders all of its pages from that handle.
+    With layout_resolution set, only the staff-system strips are rendered (render_page_strips).
+    With a RasterCache, pages rendered before (in any session) are loaded instead.
+    With bilevel, pages come as bit-packed page_raster.BilevelPage instead of gray arrays.
+    At most max_pending pages (default one per worker) are rendered ahead of the consumer.
+    page_filter(doc, page_num) (e.g. page_kind, picklable) is checked on each page first, where
+    it is rendered; the pages it turns down come as (page_num, None, what it returned).
+    """
+    doc = fitz.open(pdf_path)
+    num_pages = len(doc)
+    digest = pdf_digest(pdf_path) if cache is not None else None
+
+    pages_to_convert = determine_pages(pages_arg, num_pages)
+    if not pages_to_convert:
+        doc.close()
+        print('Invalid page range.')
+        return
+
+    num_cores = processes or max(1, multiprocessing.cpu_count() // 2)
+
+    # Single worker: render in this process with the document already open
+    if num_cores == 1:
+        try:
+            for page_num in pages_to_convert:
+                yield checked_render_page(doc, page_num, resolution, layout_resolution, cache, digest, bilevel,
+                                          page_filter)
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    with multiprocessing.Pool(processes=num_cores, initializer=_init_worker, initargs=(pdf_path, cache, digest)) as pool:
+        # Only max_pending pages rendered or rendering at a time: pool.imap would render every
+        # page ahead of the consumer and hold them all in memory while recognition runs
+        max_pending = max_pending or num_cores
+        pending = collections.deque()
+        for page_num in pages_to_convert:
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(_render_worker,
+                                            ((page_num, resolution, layout_resolution, bilevel, page_filter),)))
+        while pending:
+            yield pending.popleft().get()
+
+def convert_pdf_to_png(pdf_path, pages_arg, resolution=300, outpath=None, cache=None):
     name = os.path.splitext(os.path.basename(pdf_path))[0]
     doc = fitz.open(pdf_path)
     num_pages = len(doc)
@@ -34,8 +380,11 @@ def convert_pdf_to_png(pdf_path, pages_arg, resolution=300, outpath=None):
     # Determine the number of cores to use
     num_cores = max(1, multiprocessing.cpu_count() // 2)  # Using half of available cores
 
+    # Content hash only needed to look pages up in the cache
+    digest = pdf_digest(pdf_path) if cache is not None else None
+
     # Set up multiprocessing with limited cores
-    with multiprocessing.Pool(processes=num_cores) as pool:
+    with multiprocessing.Pool(processes=num_cores, initializer=_init_worker, initargs=(pdf_path, cache, digest)) as pool:
         args = [(pdf_path, page_num, name, resolution, out_path) for page_num in pages_to_convert]
         pool.starmap(convert_page, args)
 
@@ -43,6 +392,59 @@ def convert_pdf_to_png(pdf_path, pages_arg, resolution=300, outpath=None):
     print(f"Converted {len(pages_to_convert)} pages to images at {resolution} DPI")
     print(f"Execution time: {end_time - start_time} seconds")
 
+def _stream_producer(pdf_path, pages_to_convert, resolution, layout_resolution, cache, bilevel, page_queue,
+                     page_filter=None):
+    try:
+        doc = fitz.open(pdf_path)
+        digest = pdf_digest(pdf_path) if cache is not None else None
+        for page_num in pages_to_convert:
+            # Blocks while the queue is full, so rendering never runs far ahead
+            page_queue.put(checked_render_page(doc, page_num, resolution, layout_resolution, cache, digest, bilevel,
+                                               page_filter))
+        doc.close()
+    except Exception as e:
+        page_queue.put(e)
+    finally:
+        page_queue.put(None)
+
+def stream_pdf_pages(pdf_path, pages_arg, resolution=300, queue_size=2, layout_resolution=None, cache=None,
+                     bilevel=False, page_filter=None):
+    """
+    Yield (page_num, gray_array, page_map) while the following pages are rendered in a
+    background process. At most queue_size rendered pages wait in memory.
+    With bilevel, pages come as bit-packed page_raster.BilevelPage (8x less to queue).
+    page_filter as in convert_pdf_to_arrays, checked in the background process too.
+    """
+    doc = fitz.open(pdf_path)
+    num_pages = len(doc)
+    doc.close()
+
+    pages_to_convert = determine_pages(pages_arg, num_pages)
+    if not pages_to_convert:
+        print('Invalid page range.')
+        return
+
+    page_queue = multiprocessing.Queue(maxsize=queue_size)
+    producer = multiprocessing.Process(target=_stream_producer,
+                                       args=(pdf_path, pages_to_convert, resolution, layout_resolution, cache,
+                                             bilevel, page_queue, page_filter),
+                                       daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = page_queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Consumer stopped early (error or break): don't leave the renderer behind
+        if producer.is_alive():
+            producer.terminate()
+        producer.join()
+
 def determine_pages(pages_arg, num_pages):
     if pages_arg.isdigit():
         page = int(pages_arg)
@@ -111,7 +513,7 @@ if __name__ == '__main__':
         pdf_path = sys.argv[1]
         pages_arg = sys.argv[2]
         outpath = sys.argv[3]
-        convert_pdf_to_png(pdf_path, pages_arg, outpath=outpath)
+        convert_pdf_to_png(pdf_path, pages_arg, outpath=outpath, cache=RasterCache())
         
     elif sys.argv == ['']:
         pdf_paths = ['/Users/gabrielmiyazawa/Desktop/Cods/algs/try_pngs/IMSLP15870-Sibelius_-_4_Pieces_for_Violin_or_Cello_and_Piano,_Op.78_Nos.1-3.pdf']
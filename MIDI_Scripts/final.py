@@ -1,47 +1,182 @@
 import os
 import time
 import argparse
-from main import process_sheet_music
+from functools import partial
+import cv2
+import fitz  # PyMuPDF
+from main import process_sheet_music, process_born_digital
 from NoteModifiers import process_midi
 from Make_MIDI import make_midi
-        
+from convert_best import convert_pdf_to_arrays, stream_pdf_pages, page_kind, render_page_gray
+from born_digital import legacy_music_font
+from raster_cache import RasterCache
+from page_raster import load_gray
+from page_layout import has_staves, crop_to_content
+
+
+def process_page(page, output_dir, final_output_dir, templates_dir, page_map=None, recognition='templates',
+                 accidental_search='page', clef_search='page', calibrate_fraction=None):
+    # page is an image path, an in-memory raster, or an open PDF page read as vectors
+    if isinstance(page, tuple):
+        doc, page_num, resolution = page
+        process_born_digital(doc, page_num, output_dir, resolution)
+    else:
+        process_sheet_music(page, output_dir, templates_dir, page_map=page_map, recognition=recognition,
+                            accidental_search=accidental_search, clef_search=clef_search,
+                            calibrate_fraction=calibrate_fraction)
+
+    time.sleep(1)
+
+    process_midi(output_dir)
+
+    time.sleep(1)
+
+    make_midi(output_dir, final_output_dir)
+
+    # Clear output directory after processing each image
+    for file in os.listdir(output_dir):
+        file_path = os.path.join(output_dir, file)
+        try:
+            if os.path.isfile(file_path):
+                os.unlink(file_path)
+        except Exception as e:
+            print(f"Error deleting {file_path}: {e}")
+
+
+def report_skipped(skipped, final_output_dir):
+    # One skipped page (number or image name) per line, next to the MIDI results
+    with open(os.path.join(final_output_dir, 'skipped_pages.txt'), 'w') as file:
+        file.writelines(f'{page}\n' for page in skipped)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process sheet music image to MIDI')
     parser.add_argument('base_dir', help='Base directory for input/output')
-    
+    parser.add_argument('--pdf', action='store_true',
+                        help='Render the PDF in <base_dir>/pdf straight to memory instead of reading <base_dir>/in')
+    parser.add_argument('--pages', default='', help='Pages to render with --pdf (x,y ; x:y ; blank for all)')
+    parser.add_argument('--dpi', type=int, default=300, help='Render resolution with --pdf')
+    parser.add_argument('--layout-dpi', type=int, default=None,
+                        help='With --pdf, find staves at this DPI and render only staff-system strips at --dpi')
+    parser.add_argument('--stream', action='store_true',
+                        help='With --pdf, render the next page while the current one is recognized')
+    parser.add_argument('--queue-size', type=int, default=2, help='Rendered pages allowed to wait with --stream')
+    parser.add_argument('--no-vector', action='store_true',
+                        help='With --pdf, rasterize born-digital pages too instead of reading their glyphs')
+    parser.add_argument('--bilevel', action='store_true',
+                        help='With --pdf, hand pages over bit-packed black and white (8x less memory than gray). '
+                             'Recognition unpacks them and matches on black and white, missing some symbols '
+                             '(fewer noteheads and naturals than on gray)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='With --pdf, always render instead of reusing rasters cached from earlier runs')
+    parser.add_argument('--cache-dir', default=None, help='Raster cache directory (default ~/.cache/pdf2midi/rasters)')
+    parser.add_argument('--keep-all', action='store_true',
+                        help='Recognize every page, skipping the staff-presence check for non-music pages')
+    parser.add_argument('--check-dpi', type=int, default=40, help='Resolution of the staff-presence check')
+    parser.add_argument('--recognition', choices=['templates', 'components'], default='templates',
+                        help='Symbol recognition of scanned pages: template matching, or the much faster '
+                             'connected-component classifier (component_classifier.py), which misses about half '
+                             'the noteheads and accidentals and some system-start clefs (a rough draft)')
+    parser.add_argument('--accidentals', choices=['page', 'notes'], default='page',
+                        help='Accidental search of scanned pages: over the whole page, or only left of the '
+                             'noteheads and after the clefs found (accidental_search.py)')
+    parser.add_argument('--clefs', choices=['page', 'zones'], default='page',
+                        help='Clef search of scanned pages: over every staff, or only at the staff starts '
+                             'and around the barlines found first (clef_zones.py)')
+    parser.add_argument('--calibrate-thresholds', type=float, nargs='?', const=0.01, default=None,
+                        metavar='FRACTION',
+                        help='Raise the matching thresholds of noisy scanned pages until at most FRACTION '
+                             '(default 0.01) of the positions pass them')
+    parser.add_argument('--preview', action='store_true',
+                        help='With --pdf, save a thumbnail of every selected page to <base_dir>/in for the viewer')
+    parser.add_argument('--preview-width', type=int, default=1000, help='Width in pixels of the --preview thumbnails')
+
     args = parser.parse_args()
-    
+
     # Directories are already created by the JS code
     input_dir = os.path.join(args.base_dir, 'in')
     output_dir = os.path.join(args.base_dir, 'out')
     final_output_dir = os.path.join(args.base_dir, 'final_output')
     templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
-    
+
+    if args.pdf:
+        pdf_dir = os.path.join(args.base_dir, 'pdf')
+        files = sorted(f for f in os.listdir(pdf_dir) if os.path.isfile(os.path.join(pdf_dir, f)))
+        # A .pdf first; otherwise the one file there, whatever its name (uploads saved
+        # without an extension)
+        pdf_files = [f for f in files if f.lower().endswith('.pdf')] or files[:1]
+        if not pdf_files:
+            print("No PDF file found in pdf directory")
+            exit(1)
+        pdf_path = os.path.join(pdf_dir, pdf_files[0])
+
+        doc = fitz.open(pdf_path)
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        cache = None if args.no_cache else RasterCache(args.cache_dir)
+
+        # Each page is checked where it is rendered, just before: born-digital pages are read
+        # from their glyphs and vectors, never rasterized, and title pages, prefaces, critical
+        # notes and blanks never reach recognition. The first page's result never waits on
+        # the checks of the last
+        page_filter = partial(page_kind, vector=not args.no_vector,
+                              check_resolution=None if args.keep_all else args.check_dpi)
+
+        # Pages arrive in order as grayscale arrays; only --preview writes to in/
+        if args.stream:
+            pages = stream_pdf_pages(pdf_path, args.pages, args.dpi, queue_size=args.queue_size,
+                                     layout_resolution=args.layout_dpi, cache=cache, bilevel=args.bilevel,
+                                     page_filter=page_filter)
+        else:
+            pages = convert_pdf_to_arrays(pdf_path, args.pages, args.dpi, layout_resolution=args.layout_dpi,
+                                          cache=cache, bilevel=args.bilevel, page_filter=page_filter)
+
+        skipped = []
+        for page_num, page, page_map in pages:
+            # The session viewer lists in/: every page as a low-resolution thumbnail, written
+            # as the page comes up. Whole pages, not the recognition rasters (cropped, or staff
+            # strips with --layout-dpi)
+            if args.preview:
+                # (by width: scanned pages often come with oversized page boxes)
+                resolution = 72 * args.preview_width / doc.load_page(page_num).rect.width
+                cv2.imwrite(os.path.join(input_dir, f'{name}_p_{page_num}.png'),
+                            render_page_gray(doc, page_num, resolution))
+
+            if page is None and page_map == 'skip':
+                print(f'Skipping page {page_num}: no staff systems found')
+                skipped.append(page_num)
+            elif page is None:
+                print(f'Processing page {page_num} (born-digital)')
+                process_page((doc, page_num, args.dpi), output_dir, final_output_dir, templates_dir)
+            else:
+                font = None if args.no_vector else legacy_music_font(doc.load_page(page_num))
+                if font:
+                    print(f'Page {page_num}: engraved in {font}, not a SMuFL font; rasterized instead of read as vectors')
+                print(f'Processing page {page_num}')
+                process_page(page, output_dir, final_output_dir, templates_dir, page_map, args.recognition,
+                             args.accidentals, args.clefs, args.calibrate_thresholds)
+        report_skipped(skipped, final_output_dir)
+        exit(0)
+
     # Get all image files from input directory
     image_files = [f for f in os.listdir(input_dir) if f.endswith(('.png', '.jpg', '.jpeg'))]
     if not image_files:
         print("No image files found in input directory")
         exit(1)
-    
+
     # Process each image file
+    skipped = []
     for image_file in sorted(image_files):  # Sort to maintain page order
-        image_path = os.path.join(input_dir, image_file)
-        process_sheet_music(image_path, output_dir, templates_dir)
-        
-        time.sleep(1)
-
-        process_midi(output_dir)
-
-        time.sleep(1)
-
-        make_midi(output_dir, final_output_dir)
-
-        # Clear output directory after processing each image
-        for file in os.listdir(output_dir):
-            file_path = os.path.join(output_dir, file)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                print(f"Error deleting {file_path}: {e}")
+        gray = load_gray(os.path.join(input_dir, image_file))
+        if not args.keep_all:
+            # Same check as for PDF pages, on a copy shrunk to --check-dpi (images assumed at --dpi)
+            scale = args.check_dpi / args.dpi
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if not has_staves(small):
+                print(f'Skipping page {image_file}: no staff systems found')
+                skipped.append(image_file)
+                continue
+        # Recognition runs on the inked region only; page_map places it back on the image
+        page, page_map = crop_to_content(gray)
+        process_page(page, output_dir, final_output_dir, templates_dir, page_map, args.recognition, args.accidentals,
+                     args.clefs, args.calibrate_thresholds)
+    report_skipped(skipped, final_output_dir)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from batched_match import batched_responses
+from match_peaks import response_peaks
+
+
+def fused_match(page, templates, threshold, top_k=None):
+    """
+    Reduce the responses of a whole category into one running max map and an argmax
+    map of template indices, then extract peaks once for the category. Both maps are
+    page-sized and indexed by the template's centre, so templates of different sizes
+    line up and memory does not grow with the number of templates.
+
+    :param page: Gray uint8 page.
+    :param templates: template_bank.Template list.
+    :return: List of (template, (x, y), score), (x, y) the template's top-left corner,
+             one peak per blob of the max map scoring >= threshold (at most top_k),
+             best first.
+    """
+    height, width = page.shape
+    best = np.full((height, width), -1.0, dtype=np.float32)
+    best_id = np.full((height, width), -1, dtype=np.int16)
+
+    # Templates in the order batched_responses yields them, indexed by best_id
+    order = []
+    for template, res in batched_responses(page, templates):
+        index = len(order)
+        order.append(template)
+        if res is None:
+            continue
+        # Response pixel (x, y) is the window centred at (x + w // 2, y + h // 2)
+        cy, cx = template.height // 2, template.width // 2
+        region = best[cy:cy + res.shape[0], cx:cx + res.shape[1]]
+        better = res > region
+        region[better] = res[better]
+        best_id[cy:cy + res.shape[0], cx:cx + res.shape[1]][better] = index
+
+    matches = []
+    for (x, y), score in response_peaks(best, threshold, top_k):
+        template = order[best_id[y, x]]
+        matches.append((template, (x - template.width // 2, y - template.height // 2), score))
+    return matches
@@ -105,6 +105,8 @@ def get_barline(stem_lines_var,image_path, out_path, min_length = 200):
     # Draw
     if isinstance(image_path, str):  # Check if image_input is a file path
         binary = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)  # Read image from file path
+    elif image_path.ndim == 2:
+        binary = image_path  # Already single channel
     else:
         binary = cv2.cvtColor(image_path, cv2.COLOR_BGR2GRAY)  # Convert image array to grayscale
     contour_image = np.zeros_like(binary)
@@ -136,6 +138,8 @@ if __name__ == '__main__':
     # Load the image
     if isinstance(image_path, str):  # Check if image_input is a file path
         binary = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)  # Read image from file path
+    elif image_path.ndim == 2:
+        binary = image_path  # Already single channel
     else:
         binary = cv2.cvtColor(image_path, cv2.COLOR_BGR2GRAY)  # Convert image array to grayscale
 
@@ -56,6 +56,8 @@ def contour_notebar(image_path, output_path, separate_kernel = (7,7), blur_thres
     
     if __name__ == '__main__':
         image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    elif image_path.ndim == 2:
+        image = image_path  # Already the gray page
     else: 
         image = cv2.cvtColor(image_path, cv2.COLOR_BGR2GRAY)
     
@@ -97,6 +99,8 @@ def contour_stem(image_path, output_path):
     
     if __name__ == '__main__':
         image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    elif image_path.ndim == 2:
+        image = image_path  # Already the gray page
     else: 
         image = cv2.cvtColor(image_path, cv2.COLOR_BGR2GRAY)
                 
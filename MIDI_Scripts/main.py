@@ -13,6 +13,8 @@ import cv2
 
 # CV based functions
 from template_match_last import multi_template_match
+from match_peaks import box_nms
+from template_bank import get_template_bank, staff_scale
 from rm_rect import remove_rectangles
 from morph_map import morphologyex
 from get_shaft import contour_notebar, contour_stem
@@ -20,26 +22,80 @@ from almost_lines import std_staff
 from staff_lines import main_lines
 from get_barlines_v3 import get_barline
 from ledger_centroids import find_centroids
+from page_raster import load_gray, BilevelPage
+from page_layout import matches_to_page, estimate_staff_spacing, find_staves, staff_bands, stack_strips
+from component_classifier import classify_components
+from accidental_search import accidental_windows, pair_accidentals
+from clef_zones import clef_zones
+from born_digital import extract_symbols, extract_lines, staff_groups
 
 # MIDI building functions
 from NoteMapper import Notes_Mapper
 from match_accidents import match_acc
 
-def process_sheet_music(main_image_path, output_directory, templates_directory):
+# Template categories matched on every page.
+# 'engine' (matching_engines.py): 'full' matches every template over the whole page,
+# 'pyramid' matches on a half-size page first and re-checks only around those hits (same thresholds),
+# 'batched' shares the page statistics between templates of the same size,
+# 'fused' is batched reduced to one max/argmax map per category before peak extraction.
+# 'binary' scores Hamming similarity on the bit-packed page (its thresholds are not CCOEFF ones),
+# 'proposal' (filled noteheads only) correlates only around notehead-sized ink blobs,
+# 'windows' only inside a mask of allowed positions (accidental_search='notes' and clef_search='zones' use it).
+# 'roi': 'staff' matches only inside the staff bands (staff plus ledger_margin)
+TEMPLATES_DIRS = [
+    {'path': 'Core/Notes_Full/', 'thresholds': 0.75, 'min_distance': 10, 'engine': 'proposal', 'roi': 'staff'}, 
+    {'path': 'Core/Claves/Cleff_Fa/', 'thresholds': 0.65, 'min_distance': 15, 'engine': 'pyramid', 'roi': 'staff'},
+    {'path': 'Core/Claves/Cleff_Sol/', 'thresholds': 0.65, 'min_distance': 15, 'engine': 'pyramid', 'roi': 'staff'},
+    {'path': 'Core/Accidents/Sharp/', 'thresholds': 0.7, 'min_distance': 10, 'engine': 'pyramid'},
+    {'path': 'Core/Accidents/Flat/', 'thresholds': 0.75, 'min_distance': 10, 'engine': 'pyramid'}, 
+    {'path': 'Core/Accidents/Natural/', 'thresholds': 0.75, 'min_distance': 10, 'engine': 'pyramid'},
+    {'path': 'Core/Rests/Rest_Semiquaver/', 'thresholds': 0.7, 'min_distance': 15, 'engine': 'fused', 'roi': 'staff'},
+    {'path': 'Core/Rests/Rest_Quaver/', 'thresholds': 0.7, 'min_distance': 15, 'engine': 'fused', 'roi': 'staff'},
+]
+
+
+def process_sheet_music(main_image_path, output_directory, templates_directory, page_map=None, ledger_margin=4,
+                        recognition='templates', accidental_search='page', clef_search='page',
+                        calibrate_fraction=None):
     """
     Process sheet music image and generate MIDI data
     
     Args:
-        main_image_path (str): Path to input sheet music image
+        main_image_path (str, np.ndarray or BilevelPage): Path to input sheet music image, or a
+            page already rendered in memory (gray, BGR or bit-packed, see convert_best). A
+            bit-packed page is unpacked to a black and white gray page: template matching on it
+            finds fewer symbols than on the gray render (fewer noteheads and naturals above all)
         output_directory (str): Path to output directory for generated files
         templates_directory (str): Path to directory containing template images
+        page_map (list): Strips placing the input raster back on the full page, as returned
+            by convert_best.render_page; saved to page_map.txt for mapping results back
+        ledger_margin (float): Staff spaces kept above and below each staff when matching the
+            categories restricted to staff bands ('roi': 'staff')
+        recognition (str): 'templates' matches the templates of every category; 'components'
+            classifies the page's connected components instead (component_classifier.py): well
+            under a second a page, but finding far fewer symbols (on a dense scan about half the
+            noteheads and accidentals and 12 of 17 clefs, some at system starts), so pitches come
+            out wrong on staves whose clef it misses. A quick draft, not an equivalent
+        accidental_search (str): 'page' matches the accidentals over the whole page and pairs them
+            with notes and clefs afterwards (match_accidents); 'notes' matches them only left of
+            the noteheads found and after the clefs, pairing them in the same step
+            (accidental_search.py). Needs the notes and clefs matched before the accidentals
+        clef_search (str): 'page' matches the clefs over every staff band; 'zones' finds the staves
+            and barlines first and matches the clefs only at the start of each staff and around
+            its barlines (clef_zones.py). With accidental_search='notes' the key signatures are
+            then only looked for after those clefs
+        calibrate_fraction (float): Per-page threshold calibration for noisy pages: thresholds rise
+            until at most about this fraction of the positions pass them
+            (matching_engines.calibrated_threshold). None (default) keeps the thresholds
     """
     print("\nDEBUGDEBUGDEBUGDEBUGDEBUGDEBUG (main.py) - Processing output directory:", output_directory)
     # Load main image
+    # Every stage works on this one gray page; colour is only for the debug drawings
     try:
-        main_image = cv2.imread(main_image_path)
-        if main_image is None:
-            raise FileNotFoundError(f"Could not load image at path: {main_image_path}")
+        main_image_gray = load_gray(main_image_path)
+        if isinstance(main_image_path, BilevelPage):
+            print('Bilevel page: the templates are matched on its black and white unpacking, '
+                  'expect some symbols to be missed')
     except FileNotFoundError as e:
         print(e)
         return
@@ -50,20 +106,41 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
     if not os.path.isdir(templates_directory):
         os.chdir(templates_directory)
         
-    templates_dirs = [
-        {'path': 'Core/Notes_Full/', 'thresholds': 0.75, 'min_distance': 10}, 
-        {'path': 'Core/Claves/Cleff_Fa/', 'thresholds': 0.65, 'min_distance': 15},
-        {'path': 'Core/Claves/Cleff_Sol/', 'thresholds': 0.65, 'min_distance': 15},
-        {'path': 'Core/Accidents/Sharp/', 'thresholds': 0.7, 'min_distance': 10},
-        {'path': 'Core/Accidents/Flat/', 'thresholds': 0.75, 'min_distance': 10}, 
-        {'path': 'Core/Accidents/Natural/', 'thresholds': 0.75, 'min_distance': 10},
-        {'path': 'Core/Rests/Rest_Semiquaver/', 'thresholds': 0.7, 'min_distance': 15},
-        {'path': 'Core/Rests/Rest_Quaver/', 'thresholds': 0.7, 'min_distance': 15},
-    ]
+    templates_dirs = TEMPLATES_DIRS
 
     # Manually selected templates to skip
     skip_templates = None
 
+    # Most candidates one template may contribute per page, and most distinct matches of one
+    # category: several times what a dense piano page holds (~1000 notes), so only noisy
+    # pages reach them (reported when they do); they bound those pages' matching time
+    peaks_per_template = 5000
+    peaks_per_category = 5000
+
+    # Decoded once per process: later pages reuse the same templates
+    template_bank = get_template_bank().preload(templates_dirs)
+
+    # Templates follow the page's engraving size: rescaled once per staff spacing and kept
+    staff_space = estimate_staff_spacing(main_image_gray)
+    template_scale = staff_scale(staff_space)
+    print(f'Staff spacing: {staff_space} px, template scale: {template_scale:.2f}')
+
+    # Staff bands: notes, rests and clefs never appear outside a staff and its ledger lines,
+    # so those categories are matched on the bands stacked together (band_map maps back)
+    staves, spacing = find_staves(main_image_gray)
+    # Pages rendered as staff-system strips (convert_best.render_page_strips, more than one
+    # strip in page_map) are such a stack already: banding them again only adds gaps
+    strips = page_map is not None and len(page_map) > 1
+    if staves and not strips:
+        bands = staff_bands(staves, spacing, main_image_gray.shape[0], ledger_margin)
+        band_image, band_map = stack_strips([(main_image_gray[y_start:y_end], y_start, 0) for y_start, y_end in bands],
+                                            gap=int(round(2 * spacing)))
+        print(f'Staff bands: {len(bands)}, {band_image.shape[0]} of {main_image_gray.shape[0]} rows')
+    else:
+        band_image = band_map = None
+        if strips:
+            print(f'Staff bands: page already rendered as {len(page_map)} staff-system strips')
+
     # Store all matches
     matches_to_txt = []
 
@@ -80,11 +157,45 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
         (matches_rests, 'matches_rests.txt'),
     ]
 
+    # Every category from one pass over the page's connected components
+    if recognition == 'components':
+        # (multi_template_match creates the output directory otherwise)
+        os.makedirs(output_directory, exist_ok=True)
+        components = classify_components(main_image_gray, staff_space, [templates['path'] for templates in templates_dirs])
+
+    # Clef zones, from the staves and barlines before any matching
+    clef_mask = None
+    if clef_search == 'zones' and staves and recognition != 'components':
+        # (get_barline saves its drawing there; the barlines are found again further on)
+        os.makedirs(output_directory, exist_ok=True)
+        clef_mask = clef_zones(main_image_gray, staves, spacing, output_directory)
+        print(f'Clef zones: {np.count_nonzero(clef_mask) / clef_mask.size:.1%} of the page')
+
+    # Accidental search windows, once the notes and clefs are known (see TEMPLATES_DIRS' order)
+    accidental_mask = None
+
     # Basic templates matching
     for templates in templates_dirs:
-        matches_full, _, _ = multi_template_match(
-            main_image_path, templates['path'], output_directory, templates['thresholds'],
-            templates['min_distance'], skip_templates = skip_templates)
+        if recognition == 'components':
+            matches_full = components[templates['path']]
+        else:
+            windowed = accidental_search == 'notes' and 'Accidents' in templates['path']
+            if windowed and accidental_mask is None:
+                accidental_mask = accidental_windows(main_image_gray.shape, matches_notes, matches_cleffs, staff_space)
+                print(f'Accidental windows: {np.count_nonzero(accidental_mask) / accidental_mask.size:.1%} of the page')
+            zoned = clef_mask is not None and 'Claves' in templates['path']
+            window_mask = accidental_mask if windowed else clef_mask if zoned else None
+            # The windows are in page coordinates, so those categories are matched on the page
+            in_bands = templates.get('roi') == 'staff' and band_image is not None and window_mask is None
+            matches_full, _, _ = multi_template_match(
+                band_image if in_bands else main_image_gray, templates['path'], output_directory, templates['thresholds'],
+                templates['min_distance'] * template_scale, skip_templates = skip_templates, bank = template_bank,
+                engine = 'windows' if window_mask is not None else templates.get('engine', 'full'), scale = template_scale,
+                top_k = peaks_per_template, staff_space = staff_space, max_candidates = peaks_per_category,
+                # (the windows are too small a sample of the page to calibrate on)
+                calibrate = None if window_mask is not None else calibrate_fraction, windows = window_mask)
+            if in_bands:
+                matches_full = matches_to_page(matches_full, band_map)
         
         # Save all templates matches
         if matches_to_txt:
@@ -106,6 +217,14 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
         elif 'Rests' in templates.get('path', ''):
             matches_rests.extend(matches_full)
 
+    # One symbol per place across all categories: a sharp, a natural and a notehead claiming
+    # the same pixels (or one inside another) are resolved by score before the later stages
+    kept = {id(match) for match in box_nms(matches_to_txt)}
+    print(f'Overlap suppression: {len(matches_to_txt) - len(kept)} of {len(matches_to_txt)} matches dropped')
+    matches_to_txt = [match for match in matches_to_txt if id(match) in kept]
+    for matches, _ in match_categories:
+        matches[:] = [match for match in matches if id(match) in kept]
+
     # Save matches per categories
     for matches, filename in match_categories:
         if matches:
@@ -114,17 +233,33 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
             with open(matches_outpath, 'w') as file:
                 file.write(str(matches))
 
+    # Accidentals found next to their notes and clefs are paired there (match_acc is skipped)
+    if accidental_search == 'notes':
+        note_acc, key_sig = pair_accidentals(matches_notes, matches_accidents, matches_cleffs, staff_space)
+        print(f'Accidentals paired: {len(note_acc)} with notes, {len(key_sig)} key signatures')
+        with open(os.path.join(output_directory, 'note_acc.txt'), 'w') as file:
+            file.write(str(note_acc))
+        with open(os.path.join(output_directory, 'key_sig.txt'), 'w') as file:
+            file.write(str(key_sig))
+
     # Save templates matches and scores
     matches_outpath = os.path.join(output_directory, 'matches_all.txt')
     with open(matches_outpath, 'w') as file:
         file.write(str(matches_to_txt))
     print('All matches saved to:', output_directory)
 
+    # Save how this raster's rows map back onto the rendered page, and the matches on it
+    if page_map is not None:
+        with open(os.path.join(output_directory, 'page_map.txt'), 'w') as file:
+            file.write(str(page_map))
+        with open(os.path.join(output_directory, 'matches_page.txt'), 'w') as file:
+            file.write(str(matches_to_page(matches_to_txt, page_map)))
+
     # Reformat matches log
     matches = [tup[0] + tup[1] for tup in matches_to_txt]
 
     # Draw all rectangles on clean image
-    clean_image = cv2.imread(main_image_path)
+    clean_image = cv2.cvtColor(main_image_gray, cv2.COLOR_GRAY2BGR)
     for (x_initial, y_initial, x_final, y_final) in matches:
         cv2.rectangle(clean_image, (x_initial, y_initial), (x_final, y_final), (0, 255, 0), 2)
 
@@ -133,7 +268,7 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
     cv2.imwrite(result_path, clean_image)
 
     # Remove matched templates from main image
-    cleaned_image = remove_rectangles(main_image_path, matches, output_directory)
+    cleaned_image = remove_rectangles(main_image_gray, matches, output_directory)
     output_path = os.path.join(output_directory, 'rmrect.png')
     _ = cv2.imwrite(output_path, cleaned_image)
 
@@ -179,7 +314,7 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
     print("DEBUG (main.py) - Output directory:", output_directory)
 
     # Morphological map for horizontal lines
-    morph_img = morphologyex(main_image, output_directory, ker = (20, 1))
+    morph_img = morphologyex(main_image_gray, output_directory, ker = (20, 1))
     cv2.imwrite(os.path.join(output_directory, 'morph_staff.png'), morph_img)
 
     # Standardized (Ideal) staff
@@ -193,8 +328,17 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
     # Phase 4 - Piece components together
     # os.chdir(output_directory)
 
+    piece_together(output_directory, accidentals_paired = accidental_search == 'notes')
+
+
+def piece_together(output_directory, accidentals_paired=False):
+    # Label notes against the staffs and pair accidentals, from the files saved so far
     Notes_Mapper(output_directory, output_directory)
 
+    # note_acc.txt and key_sig.txt already written by the accidental search
+    if accidentals_paired:
+        return
+
     matched_acc, unmatched, key_sig = match_acc(output_directory, group_max_dist=50, y_threshold=20, x_limit=30, plot=False)
 
     matches_outpath = os.path.join(output_directory, 'note_acc.txt')
@@ -203,3 +347,65 @@ def process_sheet_music(main_image_path, output_directory, templates_directory):
     matches_outpath = os.path.join(output_directory, 'key_sig.txt')
     with open(matches_outpath, 'w') as file:
         file.write(str(key_sig))
+
+
+def process_born_digital(doc, page_num, output_directory, resolution=300):
+    """
+    Born-digital fast path: read symbols from the music-font text layer and lines from the
+    vector drawings of a PDF page, and write the same files process_sheet_music does.
+    No pixel processing is involved besides the debug drawing the note mapper expects.
+
+    Args:
+        doc (fitz.Document): Open PDF document
+        page_num (int): Page to process (see born_digital.is_born_digital)
+        output_directory (str): Path to output directory for generated files
+        resolution (int): DPI of the pixel coordinates written, as if rendered at it
+    """
+    page = doc.load_page(page_num)
+    categories, staff_space = extract_symbols(page, resolution)
+    lines = extract_lines(page, staff_space, resolution)
+
+    # Save matches per categories
+    matches_to_txt = []
+    for category, filename in [('notes', 'matches_notes.txt'), ('cleffs', 'matches_cleffs.txt'),
+                               ('accidents', 'matches_accidents.txt'), ('rests', 'matches_rests.txt')]:
+        matches = categories[category]
+        matches_to_txt.extend(matches)
+        print(category + ':', len(matches), 'matches')
+        # Later stages open every category file, so empty ones are written too
+        with open(os.path.join(output_directory, filename), 'w') as file:
+            file.write(str(matches))
+
+    with open(os.path.join(output_directory, 'matches_all.txt'), 'w') as file:
+        file.write(str(matches_to_txt))
+
+    with open(os.path.join(output_directory, 'stems_lines.txt'), 'w') as file:
+        file.write(str(lines['stems']))
+
+    # Blank page-sized canvas for the stages that draw their findings
+    zoom = resolution / 72
+    canvas = np.full((int(round(page.rect.height * zoom)), int(round(page.rect.width * zoom)), 3), 255, dtype=np.uint8)
+    for (start, end, _, _) in matches_to_txt:
+        cv2.rectangle(canvas, start, end, (0, 255, 0), 2)
+    for coords in lines['bars'] + lines['stems']:
+        cv2.line(canvas, coords[0], coords[1], (0, 0, 255), 2)
+
+    # Get bar lines
+    get_barline(lines['stems'], canvas, output_directory, min_length = 50)
+
+    # Staffs, as std_staff and main_lines would save them
+    with open(os.path.join(output_directory, 'staves.txt'), 'w') as file:
+        file.write(str(lines['staff_lines']))
+    staff_ideal = staff_groups(lines['staff_lines'])
+    with open(os.path.join(output_directory, 'std_staffs.txt'), 'w') as file:
+        file.write(str(staff_ideal))
+    for staff in staff_ideal:
+        for y in staff:
+            cv2.line(canvas, (0, y), (canvas.shape[1] - 1, y), (255, 0, 0), 1)
+    cv2.imwrite(os.path.join(output_directory, 'all_so_far.png'), canvas)
+
+    # Ledger lines
+    with open(os.path.join(output_directory, 'centroids.txt'), 'w') as file:
+        file.write(str(lines['centroids']))
+
+    piece_together(output_directory)
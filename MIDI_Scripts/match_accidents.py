@@ -340,6 +340,34 @@ def display_matchings(out_path, matchings, key_matches=None):
 
 
 
+# Matches as the dictionaries the steps above work on
+def accident_entry(arr):
+    label = arr[3].split('_')[0]
+    # For flats, centre around the 2/3-of-the-way-y
+    loc = ( central_point(arr[0][0], arr[1][0]),
+           arr[0][1] + 2 * (arr[1][1] - arr[0][1]) // 3
+           ) if label == 'ab' else central_point(arr[0:2])
+    return {
+        'ref': arr[0:2],
+        'loc': loc,
+        'label': label,
+    }
+
+def note_entry(arr):
+    return {
+        'ref': arr[0:2],
+        'loc': central_point(arr[0:2]),
+        'label': arr[3].split('_')[0],
+    }
+
+def clef_entry(arr):
+    return {
+        'ref': arr[0:2],
+        'loc': arr[0:2],
+        'label': arr[3].split('_')[0],
+    }
+
+
 def match_acc(out_path, group_max_dist=50, y_threshold=20, x_limit=30, plot = False):
 
     # os.chdir(out_path)
@@ -363,35 +391,9 @@ def match_acc(out_path, group_max_dist=50, y_threshold=20, x_limit=30, plot = Fa
     notes = matches_data['notes']
     clefs = matches_data['cleffs']
     
-    accs_dic = []
-    for arr in accs:
-        label = arr[3].split('_')[0]
-        # For flats, centre around the 2/3-of-the-way-y
-        loc = ( central_point(arr[0][0], arr[1][0]),
-               arr[0][1] + 2 * (arr[1][1] - arr[0][1]) // 3
-               ) if label == 'ab' else central_point(arr[0:2])
-        
-        accs_dic.append({
-            'ref': arr[0:2],
-            'loc': loc,
-            'label': label,
-        })
-        
-    notes_dic = []
-    for arr in notes:
-        notes_dic.append({
-            'ref': arr[0:2],
-            'loc': central_point(arr[0:2]),
-            'label': arr[3].split('_')[0],
-        })
-    
-    clefs_dic = []
-    for arr in clefs:
-        clefs_dic.append({
-            'ref': arr[0:2],
-            'loc': arr[0:2],
-            'label': arr[3].split('_')[0],
-        })
+    accs_dic = [accident_entry(arr) for arr in accs]
+    notes_dic = [note_entry(arr) for arr in notes]
+    clefs_dic = [clef_entry(arr) for arr in clefs]
      
 
     
@@ -0,0 +1,117 @@
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+
+def response_peaks(res, threshold, top_k=None, offset=(0, 0)):
+    """
+    One candidate per blob of a matchTemplate response: the best pixel of each connected
+    region scoring >= threshold, instead of every pixel above it.
+
+    :param top_k: Keep only the top_k best peaks (None keeps all).
+    :param offset: (x, y) added to every peak, for responses of a window of the page.
+    :return: List of ((x, y), score), best first.
+    """
+    mask = (res >= threshold).astype(np.uint8)
+    if not mask.any():
+        return []
+
+    count, labels = cv2.connectedComponents(mask, connectivity=8)
+    ys, xs = np.nonzero(labels)
+    blob = labels[ys, xs]
+    scores = res[ys, xs]
+
+    # Per blob, the highest score, in linear time (no sort over every pixel above threshold,
+    # which on noisy pages can be millions); ties keep the first pixel in row order
+    blob_max = np.full(count, -np.inf, dtype=scores.dtype)
+    np.maximum.at(blob_max, blob, scores)
+    candidates = np.nonzero(scores == blob_max[blob])[0]
+    _, first = np.unique(blob[candidates], return_index=True)
+    best = candidates[first]
+
+    # Bounded budget: only the top_k best blobs are ever sorted
+    if top_k is not None and len(best) > top_k:
+        best = best[np.argpartition(-scores[best], top_k - 1)[:top_k]]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    return [((int(xs[i]) + offset[0], int(ys[i]) + offset[1]), float(scores[i])) for i in best]
+
+
+def grid_nms(matches, min_distance):
+    """
+    Greedy proximity filter over matches sorted best first: a match is kept unless the
+    centre of an already kept one lies closer than min_distance. Kept centres are bucketed
+    in a grid of min_distance cells, so each match is compared with its 3x3 neighbourhood
+    only. Same result as comparing against every kept match.
+    """
+    if min_distance <= 0:
+        return list(matches)
+
+    grid = defaultdict(list)
+    kept = []
+    for match in matches:
+        (x_initial, y_initial), (x_final, y_final) = match[0], match[1]
+        cx, cy = (x_initial + x_final) / 2, (y_initial + y_final) / 2
+        cell_x, cell_y = int(cx // min_distance), int(cy // min_distance)
+
+        close = False
+        for gx in (cell_x - 1, cell_x, cell_x + 1):
+            for gy in (cell_y - 1, cell_y, cell_y + 1):
+                if any((cx - kx) ** 2 + (cy - ky) ** 2 < min_distance ** 2 for kx, ky in grid[(gx, gy)]):
+                    close = True
+                    break
+            if close:
+                break
+
+        if not close:
+            kept.append(match)
+            grid[(cell_x, cell_y)].append((cx, cy))
+    return kept
+
+
+def box_nms(matches, max_overlap=0.5, max_contained=0.9):
+    """
+    Greedy suppression by box overlap, for matches of any category: best score first, a
+    match is dropped when it overlaps a kept one by more than max_overlap (intersection
+    over union), or when max_contained of the smaller of the two boxes lies inside the
+    other. Kept boxes are indexed in a grid of median-box-sized cells, so each match is
+    only compared with the kept boxes in the cells it covers.
+
+    :return: Kept matches, best first.
+    """
+    matches = sorted(matches, key=lambda match: match[2], reverse=True)
+    if not matches:
+        return []
+    cell = max(1, int(np.median([max(x1 - x0, y1 - y0) for (x0, y0), (x1, y1), _, _ in matches])))
+
+    grid = defaultdict(list)
+    kept = []
+    for match in matches:
+        (x0, y0), (x1, y1) = match[0], match[1]
+        area = max(1, (x1 - x0) * (y1 - y0))
+        cells = [(gx, gy) for gx in range(x0 // cell, x1 // cell + 1) for gy in range(y0 // cell, y1 // cell + 1)]
+
+        suppressed = False
+        seen = set()
+        for key in cells:
+            for index in grid[key]:
+                if index in seen:
+                    continue
+                seen.add(index)
+                (kx0, ky0), (kx1, ky1) = kept[index][0], kept[index][1]
+                iw, ih = min(x1, kx1) - max(x0, kx0), min(y1, ky1) - max(y0, ky0)
+                if iw <= 0 or ih <= 0:
+                    continue
+                inter = iw * ih
+                kept_area = max(1, (kx1 - kx0) * (ky1 - ky0))
+                if inter / (area + kept_area - inter) > max_overlap or inter / min(area, kept_area) >= max_contained:
+                    suppressed = True
+                    break
+            if suppressed:
+                break
+
+        if not suppressed:
+            for key in cells:
+                grid[key].append(len(kept))
+            kept.append(match)
+    return kept
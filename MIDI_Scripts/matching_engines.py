@@ -0,0 +1,220 @@
+"""
+Template matching engines.
+
+An engine takes the gray page, one category's templates (template_bank.Template) and a
+threshold, and returns candidate matches ((x0, y0), (x1, y1), score, template_name).
+match_templates runs one and applies the shared proximity filter and usage count, so
+multi_template_match and benchmark_engines.py treat every engine the same way.
+
+'full' (cv2.matchTemplate over the whole page) is the reference. Add an engine with:
+
+    @register_engine('name')
+    def name_engine(page, templates, threshold, top_k=None, **params):
+        ...
+
+params carries the optional settings of every engine (pyramid_factor, bilevel, staff_space, windows);
+each engine ignores the ones it does not use. An engine made for some categories only
+declares them (register_engine(name, categories=('Notes_Full',))), and one that needs
+per-page input besides the templates (needs_context=True, e.g. a windows mask) is left
+out of the benchmark's default set.
+"""
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from pyramid_match import downsample, pyramid_match
+from batched_match import batched_match
+from fused_match import fused_match
+from binary_match import BinaryPage, binary_match
+from notehead_proposals import verify_proposals
+from accidental_search import window_match
+from match_peaks import response_peaks, grid_nms
+
+
+REFERENCE_ENGINE = 'full'
+
+ENGINES = {}
+
+# Category path fragments each engine is made for; engines missing here fit every category
+ENGINE_CATEGORIES = {}
+
+# Engines that need per-page input besides the templates
+CONTEXT_ENGINES = set()
+
+
+def register_engine(name, categories=None, needs_context=False):
+    def register(engine):
+        ENGINES[name] = engine
+        if categories is not None:
+            ENGINE_CATEGORIES[name] = tuple(categories)
+        if needs_context:
+            CONTEXT_ENGINES.add(name)
+        return engine
+    return register
+
+
+def engine_applies(name, category_path):
+    # Whether an engine is meant for a category (main.TEMPLATES_DIRS 'path')
+    categories = ENGINE_CATEGORIES.get(name)
+    return categories is None or any(category in category_path for category in categories)
+
+
+def standalone_engines():
+    # Engines that run on a page and templates alone, sorted
+    return sorted(name for name in ENGINES if name not in CONTEXT_ENGINES)
+
+
+def get_engine(name):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown matching engine '{name}' (available: {', '.join(sorted(ENGINES))})")
+    return ENGINES[name]
+
+
+def _box(template, pt, score):
+    return (pt, (pt[0] + template.width, pt[1] + template.height), score, template.name)
+
+
+@register_engine('full')
+def full_engine(page, templates, threshold, top_k=None, **params):
+    # TM_CCOEFF_NORMED of every template over the whole page
+    matches = []
+    for template in templates:
+        if page.shape[0] < template.height or page.shape[1] < template.width:
+            continue
+        res = cv2.matchTemplate(page, template.image, cv2.TM_CCOEFF_NORMED)
+        # One candidate per blob above threshold, not every pixel of it
+        matches.extend(_box(template, pt, score) for pt, score in response_peaks(res, threshold, top_k))
+    return matches
+
+
+@register_engine('pyramid')
+def pyramid_engine(page, templates, threshold, top_k=None, pyramid_factor=0.5, **params):
+    # Coarse pass on a downsampled page, full resolution only near the hits
+    small_page = downsample(page, pyramid_factor)
+    matches = []
+    for template in templates:
+        hits = pyramid_match(page, small_page, template.image, threshold, pyramid_factor, top_k=top_k)
+        matches.extend(_box(template, pt, score) for pt, score in hits)
+    return matches
+
+
+@register_engine('batched')
+def batched_engine(page, templates, threshold, top_k=None, **params):
+    # Page statistics computed once per template size, not per template
+    matches = []
+    for template, hits in batched_match(page, templates, threshold, top_k):
+        matches.extend(_box(template, pt, score) for pt, score in hits)
+    return matches
+
+
+@register_engine('fused')
+def fused_engine(page, templates, threshold, top_k=None, **params):
+    # One max/argmax map for the whole category, peaks extracted once
+    return [_box(template, pt, score) for template, pt, score in fused_match(page, templates, threshold, top_k)]
+
+
+@register_engine('binary')
+def binary_engine(page, templates, threshold, top_k=None, bilevel=None, **params):
+    # Hamming similarity on the bit-packed page (bilevel if given, else page packed once);
+    # thresholds are Hamming similarities, not CCOEFF scores
+    binary_page = BinaryPage(bilevel if bilevel is not None else page)
+    matches = []
+    for template in templates:
+        hits = binary_match(binary_page, template.image, threshold, top_k)
+        matches.extend(_box(template, pt, score) for pt, score in hits)
+    return matches
+
+
+@register_engine('proposal', categories=('Notes_Full',))
+def proposal_engine(page, templates, threshold, top_k=None, staff_space=None, **params):
+    # Filled noteheads only: correlation only in windows around notehead-sized blobs
+    matches = []
+    for template, hits in verify_proposals(page, templates, threshold, staff_space, top_k):
+        matches.extend(_box(template, pt, score) for pt, score in hits)
+    return matches
+
+
+@register_engine('windows', needs_context=True)
+def windows_engine(page, templates, threshold, top_k=None, windows=None, **params):
+    # Correlation only where the windows mask (uint8) allows a template centre, e.g.
+    # accidental_search.accidental_windows; the whole page without one
+    if windows is None:
+        return full_engine(page, templates, threshold, top_k)
+    matches = []
+    for template, hits in window_match(page, templates, threshold, windows, top_k):
+        matches.extend(_box(template, pt, score) for pt, score in hits)
+    return matches
+
+
+def calibrated_threshold(page, templates, threshold, max_fraction, factor=0.5, samples=3):
+    """
+    Per-page threshold from the response distribution: the (1 - max_fraction) quantile
+    of the TM_CCOEFF_NORMED scores of a few of the templates on the page downsampled by
+    factor, when it is higher than threshold. On a clean page only symbols score that
+    high and threshold is kept; on a noisy or textured one, where large areas would pass
+    it, it rises so no more than about max_fraction of the positions do.
+    """
+    small_page = downsample(page, factor)
+    quantiles = []
+    for index in np.linspace(0, len(templates) - 1, min(samples, len(templates))).astype(int):
+        small_template = downsample(templates[index].image, factor)
+        if small_template.shape[0] > small_page.shape[0] or small_template.shape[1] > small_page.shape[1]:
+            continue
+        res = cv2.matchTemplate(small_page, small_template, cv2.TM_CCOEFF_NORMED)
+        quantiles.append(float(np.quantile(res, 1 - max_fraction)))
+    return max(threshold, float(np.median(quantiles))) if quantiles else threshold
+
+
+def match_templates(page, templates, threshold, min_distance, engine=REFERENCE_ENGINE, top_k=None,
+                    max_candidates=None, calibrate=None, **params):
+    """
+    Match a template set on a page with one engine.
+
+    :param page: Gray uint8 page.
+    :param templates: template_bank.Template list.
+    :param engine: Name of a registered engine.
+    :param top_k: Most candidates kept per template (per category for 'fused'); a template
+                  reaching it is reported, as it may have lost real matches.
+    :param max_candidates: Most matches kept for the whole category, best first, counted
+                           after the proximity filter (distinct locations, not the raw
+                           candidates every template finds for the same symbol); reported
+                           when it truncates.
+    :param calibrate: Raise threshold for this page so that at most about this fraction of
+                      positions pass it (calibrated_threshold); None keeps threshold.
+                      Not for 'binary', whose scores are on another scale.
+    :return: (matches, template_usage): matches best first, none closer than min_distance
+             to a better one; template_usage counts the matches of every template.
+    """
+    if calibrate and templates and engine != 'binary':
+        calibrated = calibrated_threshold(page, templates, threshold, calibrate)
+        if calibrated > threshold:
+            print(f'Threshold raised from {threshold:.2f} to {calibrated:.2f} for this page')
+            threshold = calibrated
+
+    candidates = get_engine(engine)(page, templates, threshold, top_k=top_k, **params)
+
+    if top_k is not None:
+        # ('fused' budgets the whole category at once)
+        found = {'(category)': len(candidates)} if engine == 'fused' else Counter(c[3] for c in candidates)
+        full = sorted(name for name, count in found.items() if count >= top_k)
+        if full:
+            print(f'{len(full)} template(s) reached the {top_k} candidates budget, matches may be missing: '
+                  f'{", ".join(full[:5])}')
+
+    # Sort matches by confidence
+    candidates.sort(key=lambda x: x[2], reverse=True)
+
+    # Filter matches by proximity to similar matches to avoid repeated
+    # (grid-bucketed, so each match is only compared with its neighbours)
+    matches = grid_nms(candidates, min_distance)
+
+    # Category budget on distinct locations: every template finds the same symbol again
+    if max_candidates is not None and len(matches) > max_candidates:
+        print(f'Category budget: {len(matches)} matches cut to the best {max_candidates}')
+        matches = matches[:max_candidates]
+
+    template_usage = {template.name: 0 for template in templates}
+    for match in matches:
+        template_usage[match[3]] += 1
+    return matches, template_usage
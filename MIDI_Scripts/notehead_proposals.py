@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+from match_peaks import response_peaks
+from page_layout import estimate_staff_spacing
+
+
+def propose_noteheads(gray, staff_space, core=0.35, spread=0.6):
+    """
+    Centres of filled blobs the size of a notehead: peaks of the distance transform of
+    the page's ink. Staff lines, stems, flags, beams and text strokes are thinner than
+    2 * core staff spaces and never reach it; a filled notehead (about one staff space
+    tall) peaks near its centre, also when it touches the next one in a chord.
+
+    :param spread: Size in staff spaces of the square within which a peak must be the highest.
+    :return: (N, 2) float array of (x, y) centres.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    distance = cv2.distanceTransform(binary, cv2.DIST_L2, 3)
+
+    size = max(3, int(round(spread * staff_space)))
+    # Square neighbourhood: separable, so much faster than an ellipse on a large page
+    local_max = cv2.dilate(distance, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+    peaks = (distance >= core * staff_space) & (distance >= local_max)
+
+    # Flat-topped peaks are several pixels: one proposal each
+    count, _, _, centroids = cv2.connectedComponentsWithStats(peaks.astype(np.uint8), connectivity=8)
+    return centroids[1:count]
+
+
+def proposal_mosaic(page, centres, tile_size):
+    """
+    Pack tile_size (h, w) windows centred on the proposals into one image, in a grid
+    with no gaps, so each template is correlated against all of them in one call.
+
+    :return: (mosaic, origins) where origins[i] is the page (x, y) of tile i's top-left
+             corner; tile i is at row i // columns, column i % columns.
+    """
+    h, w = tile_size
+    # White border so tiles near the page edge keep their size
+    padded = cv2.copyMakeBorder(page, h, h, w, w, cv2.BORDER_CONSTANT, value=255)
+
+    columns = int(np.ceil(np.sqrt(len(centres))))
+    rows = int(np.ceil(len(centres) / columns))
+    mosaic = np.full((rows * h, columns * w), 255, dtype=np.uint8)
+    origins = np.zeros((len(centres), 2), dtype=int)
+    for i, (cx, cy) in enumerate(centres):
+        x0, y0 = int(round(cx)) - w // 2, int(round(cy)) - h // 2
+        r, c = divmod(i, columns)
+        mosaic[r * h:(r + 1) * h, c * w:(c + 1) * w] = padded[y0 + h:y0 + 2 * h, x0 + w:x0 + 2 * w]
+        origins[i] = x0, y0
+    return mosaic, origins
+
+
+def verify_proposals(page, templates, threshold, staff_space=None, top_k=None, slack=0.25):
+    """
+    Notehead matching restricted to the proposals: TM_CCOEFF_NORMED of every template
+    only around the blobs propose_noteheads finds, all of them tiled into one mosaic.
+
+    :param staff_space: Staff spacing in pixels; estimated from the page when None.
+    :param slack: Staff spaces a notehead centre may sit away from its proposal.
+    :return: Generator of (template, [((x, y), score), ...]) with page coordinates.
+    """
+    if not staff_space:
+        staff_space = estimate_staff_spacing(page)
+    centres = propose_noteheads(page, staff_space)
+    if not len(centres):
+        return
+
+    # Room for the largest template around each centre, plus the slack on both sides
+    margin = 2 * int(round(slack * staff_space))
+    tile_h = max(template.height for template in templates) + margin
+    tile_w = max(template.width for template in templates) + margin
+    mosaic, origins = proposal_mosaic(page, centres, (tile_h, tile_w))
+    columns = mosaic.shape[1] // tile_w
+
+    for template in templates:
+        res = cv2.matchTemplate(mosaic, template.image, cv2.TM_CCOEFF_NORMED)
+        # Positions where the template would straddle two tiles are not page positions
+        ys = np.arange(res.shape[0]) % tile_h > tile_h - template.height
+        xs = np.arange(res.shape[1]) % tile_w > tile_w - template.width
+        res[ys, :] = -1
+        res[:, xs] = -1
+
+        hits = []
+        for (x, y), score in response_peaks(res, threshold, top_k):
+            x0, y0 = origins[(y // tile_h) * columns + x // tile_w]
+            hits.append(((int(x0 + x % tile_w), int(y0 + y % tile_h)), score))
+        yield template, hits
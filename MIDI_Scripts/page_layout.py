@@ -0,0 +1,258 @@
+import cv2
+import numpy as np
+
+
+def staff_line_rows(binary, min_fraction=0.5):
+    """
+    Find the y-coordinate of every long horizontal line in a binary image (ink = 255).
+
+    :param min_fraction: Minimum share of the image width a row must be covered by line pixels.
+    :return: Sorted list of line centres.
+    """
+    # Keep only long horizontal runs, dropping text, noteheads and stems
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, binary.shape[1] // 4), 1))
+    lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+
+    # Horizontal projection profile
+    profile = np.count_nonzero(lines, axis=1) / binary.shape[1]
+    rows = np.where(profile >= min_fraction)[0]
+
+    # Merge adjacent rows of the same (thick or blurred) line into its centre
+    centres = []
+    run = []
+    for row in rows:
+        if run and row - run[-1] > 1:
+            centres.append(int(round(np.mean(run))))
+            run = []
+        run.append(row)
+    if run:
+        centres.append(int(round(np.mean(run))))
+
+    return centres
+
+
+def group_staff_lines(rows, min_lines=3):
+    # Most gaps are within a staff, so the median gap is close to the staff spacing
+    if len(rows) < min_lines:
+        return []
+    spacing_guess = np.median(np.diff(rows))
+
+    staves = []
+    current = [rows[0]]
+    for prev, row in zip(rows, rows[1:]):
+        if row - prev <= 1.5 * spacing_guess:
+            current.append(row)
+        else:
+            staves.append(current)
+            current = [row]
+    staves.append(current)
+
+    return [staff for staff in staves if len(staff) >= min_lines]
+
+
+def find_staves(gray, slabs=8, min_fraction=0.5, min_lines=3):
+    """
+    Find the staves of a (low resolution) page from horizontal projection profiles.
+
+    The page is cut into vertical slabs so that slightly skewed scans still give sharp
+    profile peaks; staves found in several slabs are merged by vertical overlap.
+
+    :param gray: Single-channel uint8 page, black ink on white.
+    :return: (staves, spacing) where staves is a list of line y-coordinate lists, sorted
+             top to bottom, and spacing is the median distance between lines of a staff.
+    """
+    # Ink as white on black, with Otsu so anti-aliased low-DPI lines survive
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    width = binary.shape[1]
+    found = []
+    for i in range(slabs):
+        slab = binary[:, i * width // slabs:(i + 1) * width // slabs]
+        found.extend(group_staff_lines(staff_line_rows(slab, min_fraction), min_lines))
+    if not found:
+        return [], 0
+
+    spacing = float(np.median([gap for staff in found for gap in np.diff(staff)]))
+
+    # Merge the same staff seen in different slabs: keep the most complete line set,
+    # stretched to the full vertical extent seen across slabs
+    found.sort(key=lambda staff: staff[0])
+    groups = []
+    for staff in found:
+        if groups and staff[0] <= max(s[-1] for s in groups[-1]):
+            groups[-1].append(staff)
+        else:
+            groups.append([staff])
+
+    staves = []
+    for group in groups:
+        best = list(max(group, key=len))
+        best[0] = min(s[0] for s in group)
+        best[-1] = max(s[-1] for s in group)
+        staves.append(best)
+
+    return staves, spacing
+
+
+def count_staff_candidates(gray, slabs=8, min_fraction=0.5):
+    """
+    Count staff-like line groups over the vertical slabs of a low resolution page: four to
+    six long lines at an even spacing. Blurred text lines and ruled tables give none.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    width = binary.shape[1]
+    count = 0
+    for i in range(slabs):
+        slab = binary[:, i * width // slabs:(i + 1) * width // slabs]
+        for staff in group_staff_lines(staff_line_rows(slab, min_fraction), min_lines=4):
+            gaps = np.diff(staff)
+            if len(staff) <= 6 and gaps.min() >= 2 and gaps.max() <= 1.3 * gaps.min() + 1:
+                count += 1
+    return count
+
+
+def has_staves(gray, min_staves=2):
+    # Cheap music/non-music decision; a single staff seen in two slabs is enough
+    return count_staff_candidates(gray) >= min_staves
+
+
+def vertical_run_modes(binary, column_step=4, max_run=200):
+    """
+    Most common vertical run lengths of ink and of paper in a binary image (ink = nonzero),
+    sampled every column_step columns. In a score these are the staff line thickness and
+    the gap between staff lines.
+    """
+    columns = (binary[:, ::column_step] > 0).astype(np.int8)
+    # Pad with paper so every ink run has a start and an end
+    padded = np.pad(columns, ((1, 1), (0, 0)))
+    edges = np.diff(padded, axis=0)
+
+    # Scan column by column (transposed), so starts and ends pair up in order
+    starts = np.argwhere(edges.T == 1)
+    ends = np.argwhere(edges.T == -1)
+    ink_runs = ends[:, 1] - starts[:, 1]
+    # Paper runs lie between an ink run's end and the next ink run's start in the same column
+    same_column = starts[1:, 0] == ends[:-1, 0]
+    paper_runs = (starts[1:, 1] - ends[:-1, 1])[same_column]
+
+    ink_runs = ink_runs[ink_runs < max_run]
+    paper_runs = paper_runs[paper_runs < max_run]
+    if not len(ink_runs) or not len(paper_runs):
+        return 0, 0
+    return int(np.bincount(ink_runs).argmax()), int(np.bincount(paper_runs).argmax())
+
+
+def estimate_staff_spacing(gray):
+    """
+    Staff spacing in pixels (line centre to line centre) from vertical run lengths:
+    the most common paper run plus the most common ink run. 0 without staves.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    thickness, gap = vertical_run_modes(binary)
+    return thickness + gap
+
+
+def staff_bands(staves, spacing, height, ledger_margin=4):
+    """
+    Vertical bands covering each staff plus room for ledger lines, merged where they overlap.
+
+    :param ledger_margin: Extra space kept above and below each staff, in staff spaces.
+    :return: List of (y_start, y_end) bands, clipped to the image height.
+    """
+    pad = int(round(ledger_margin * spacing))
+    bands = []
+    for staff in staves:
+        y_start = max(0, staff[0] - pad)
+        y_end = min(height, staff[-1] + pad)
+        if bands and y_start <= bands[-1][1]:
+            bands[-1] = (bands[-1][0], max(bands[-1][1], y_end))
+        else:
+            bands.append((y_start, y_end))
+    return bands
+
+
+def content_bbox(gray, margin=0):
+    """
+    Bounding box of the inked part of a page, as (x0, y0, x1, y1) pixel slice bounds
+    grown by margin and clipped to the image. None for a blank page.
+    Rows and columns with only a few ink pixels (scanner dust) do not count.
+    """
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = binary.shape
+
+    rows = np.where(binary.sum(axis=1) > max(2, width // 500))[0]
+    cols = np.where(binary.sum(axis=0) > max(2, height // 500))[0]
+    if not len(rows) or not len(cols):
+        return None
+
+    return (max(0, int(cols[0]) - margin), max(0, int(rows[0]) - margin),
+            min(width, int(cols[-1]) + 1 + margin), min(height, int(rows[-1]) + 1 + margin))
+
+
+def crop_to_content(gray, offset=(0, 0), margin=8):
+    """
+    Crop a page to its inked content. offset is where gray's top-left corner sits on the
+    page; the returned page_map places the crop back there (see to_page_coords).
+    """
+    bbox = content_bbox(gray, margin)
+    if bbox is None:
+        return gray, [(0, offset[1], gray.shape[0], offset[0])]
+    x0, y0, x1, y1 = bbox
+    # Contiguous copy: OpenCV would copy a strided view on every call anyway
+    cropped = np.ascontiguousarray(gray[y0:y1, x0:x1])
+    return cropped, [(0, offset[1] + y0, cropped.shape[0], offset[0] + x0)]
+
+
+def stack_strips(strips, gap):
+    """
+    Stack (strip, src_y, src_x) pieces top to bottom with gap white rows between them.
+    Returns (gray, page_map) with one (dst_y, src_y, height, src_x) entry per strip.
+    """
+    # Clip rounding can leave strips a pixel apart in width
+    width = min(strip.shape[1] for strip, _, _ in strips)
+
+    pieces = []
+    page_map = []
+    dst_y = 0
+    for strip, src_y, src_x in strips:
+        if pieces:
+            pieces.append(np.full((gap, width), 255, dtype=np.uint8))
+            dst_y += gap
+        pieces.append(strip[:, :width])
+        page_map.append((dst_y, src_y, strip.shape[0], src_x))
+        dst_y += strip.shape[0]
+
+    return np.vstack(pieces), page_map
+
+
+def identity_map(image):
+    # A single strip covering the whole image at no offset
+    return [(0, 0, image.shape[0], 0)]
+
+
+def to_page_coords(point, page_map):
+    """
+    Map a point of a stacked/cropped raster back to full-page pixel coordinates.
+
+    :param page_map: List of (dst_y, src_y, height, src_x) strips, as returned by
+                     convert_best.render_page_strips.
+    """
+    x, y = point
+    for dst_y, src_y, height, src_x in page_map:
+        if dst_y <= y < dst_y + height:
+            return x + src_x, y - dst_y + src_y
+    # Points in the gaps between strips belong to the closest strip above
+    dst_y, src_y, height, src_x = max((s for s in page_map if s[0] <= y), key=lambda s: s[0],
+                                      default=page_map[0])
+    return x + src_x, y - dst_y + src_y
+
+
+def matches_to_page(matches, page_map):
+    # Same tuples as multi_template_match, shifted by the strip holding each top-left corner
+    page_matches = []
+    for (start, end, *rest) in matches:
+        page_x, page_y = to_page_coords(start, page_map)
+        dx, dy = page_x - start[0], page_y - start[1]
+        page_matches.append(((page_x, page_y), (end[0] + dx, end[1] + dy)) + tuple(rest))
+    return page_matches
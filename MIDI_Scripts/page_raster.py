@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+
+class BilevelPage:
+    """
+    Bit-packed black and white page: one bit per pixel, ink = 1, rows padded to whole bytes.
+    Eight times smaller than the gray raster it came from (24 times smaller than BGR).
+    A transport and cache format: the recognition stages work on its unpacked gray page,
+    and template matching loses some symbols to the binarization.
+    """
+    def __init__(self, bits, width=None):
+        self.bits = bits
+        # Without a width the padding columns are kept; they are white, so harmless
+        self.width = width or bits.shape[1] * 8
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.width
+
+    def unpack(self):
+        # Back to the gray convention the detectors threshold on: ink 0, paper 255
+        ink = np.unpackbits(self.bits, axis=1, count=self.width)
+        return ((1 - ink) * 255).astype(np.uint8)
+
+
+def pack_bilevel(gray, threshold=None):
+    """
+    Binarize a gray page and pack it 8 pixels per byte.
+
+    :param threshold: Gray level below which a pixel is ink; Otsu's when None.
+    """
+    if threshold is None:
+        _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    else:
+        ink = (gray < threshold).astype(np.uint8)
+    return BilevelPage(np.packbits(ink, axis=1), gray.shape[1])
+
+
+def load_gray(image):
+    """
+    The canonical single-channel uint8 page (black ink on white) from whatever the
+    caller holds: an image path, a gray or BGR array, or a BilevelPage.
+    """
+    if isinstance(image, str):
+        gray = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise FileNotFoundError(f"Could not load image at path: {image}")
+        return gray
+    if isinstance(image, BilevelPage):
+        return image.unpack()
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
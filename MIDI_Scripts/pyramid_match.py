@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+from match_peaks import response_peaks
+
+
+def downsample(image, factor):
+    # Area averaging keeps thin staff lines and stems visible at the coarse level
+    return cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+
+def candidate_regions(coarse_res, coarse_threshold, template_shape, factor):
+    """
+    Full-resolution (x0, y0, x1, y1) search windows around the coarse-level hits.
+    Hits closer than a template size are merged into one window.
+    """
+    mask = (coarse_res >= coarse_threshold).astype(np.uint8)
+    if not mask.any():
+        return []
+
+    t_h, t_w = template_shape
+    kernel = np.ones((max(1, int(t_h * factor) // 2), max(1, int(t_w * factor) // 2)), np.uint8)
+    mask = cv2.dilate(mask, kernel)
+
+    regions = []
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    for x, y, w, h, _ in stats[1:count]:
+        # Each coarse pixel covers 1/factor full pixels; one more on every side for rounding
+        x0, y0 = int((x - 1) / factor), int((y - 1) / factor)
+        x1, y1 = int((x + w + 1) / factor) + t_w, int((y + h + 1) / factor) + t_h
+        regions.append((max(0, x0), max(0, y0), x1, y1))
+    return regions
+
+
+def pyramid_match(page, small_page, template, threshold, factor=0.5, coarse_slack=0.2, min_size=8, top_k=None):
+    """
+    Coarse-to-fine TM_CCOEFF_NORMED: match the downsampled template on the downsampled
+    page, then re-match at full resolution only inside windows around the coarse hits.
+
+    :param small_page: page downsampled by factor (see downsample), shared by all templates.
+    :param coarse_slack: How much lower than threshold a coarse score may be to count as a
+                         candidate; downsampling blurs edges and lowers scores.
+    :param min_size: Templates smaller than this at the coarse level are matched at full
+                     resolution only.
+    :return: List of ((x, y), score) at full resolution, one peak per blob scoring
+             >= threshold (at most top_k), best first.
+    """
+    t_h, t_w = template.shape
+    if page.shape[0] < t_h or page.shape[1] < t_w:
+        return []
+
+    if min(t_h, t_w) * factor < min_size:
+        res = cv2.matchTemplate(page, template, cv2.TM_CCOEFF_NORMED)
+        return response_peaks(res, threshold, top_k)
+
+    small_template = downsample(template, factor)
+    coarse = cv2.matchTemplate(small_page, small_template, cv2.TM_CCOEFF_NORMED)
+
+    hits = []
+    for x0, y0, x1, y1 in candidate_regions(coarse, threshold - coarse_slack, (t_h, t_w), factor):
+        window = page[y0:min(page.shape[0], y1), x0:min(page.shape[1], x1)]
+        if window.shape[0] < t_h or window.shape[1] < t_w:
+            continue
+        res = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        hits.extend(response_peaks(res, threshold, top_k, offset=(x0, y0)))
+
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+    return hits[:top_k] if top_k is not None else hits
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+# Defaults can be moved with PDF2MIDI_CACHE (directory) and PDF2MIDI_CACHE_MB (size cap)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pdf2midi', 'rasters')
+DEFAULT_MAX_MB = 2048
+
+# Part of every entry's name: raised when the rasters rendered for the same key change
+# (2: extracted scans resampled to the requested DPI), so older entries are never read
+RASTER_VERSION = 2
+
+
+def pdf_digest(pdf_path, chunk_size=1 << 20):
+    # Content hash, so the same score uploaded twice maps to the same entries
+    sha = hashlib.sha256()
+    with open(pdf_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class RasterCache:
+    """
+    On-disk cache of rendered pages keyed by PDF content hash, page, DPI, colorspace and
+    render variant. Entries are uncompressed .npz files holding the raster and its page_map
+    (and the page width of bit-packed rasters, whose rows are padded to whole bytes);
+    the least recently used ones are evicted once the directory grows past max_mb.
+    """
+    def __init__(self, cache_dir=None, max_mb=None):
+        self.cache_dir = cache_dir or os.environ.get('PDF2MIDI_CACHE', DEFAULT_CACHE_DIR)
+        self.max_bytes = int(max_mb or os.environ.get('PDF2MIDI_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, digest, page_num, resolution, colorspace, variant):
+        return os.path.join(self.cache_dir, f'{digest}_p{page_num}_{resolution}dpi_{colorspace}_{variant}_v{RASTER_VERSION}.npz')
+
+    def get(self, digest, page_num, resolution, colorspace='gray', variant='full'):
+        """Return (raster, page_map, width) or None on a miss; width is None unless stored."""
+        path = self._path(digest, page_num, resolution, colorspace, variant)
+        try:
+            with np.load(path) as data:
+                raster = data['raster']
+                page_map = [tuple(int(v) for v in row) for row in data['page_map']]
+                width = int(data['width']) if 'width' in data else None
+        except (OSError, KeyError, ValueError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return raster, page_map, width
+
+    def put(self, digest, page_num, resolution, raster, page_map, colorspace='gray', variant='full', width=None):
+        path = self._path(digest, page_num, resolution, colorspace, variant)
+
+        # Write aside and rename, so concurrent workers never read half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                extra = {} if width is None else {'width': np.int64(width)}
+                np.savez(file, raster=raster, page_map=np.asarray(page_map, dtype=np.int64).reshape(-1, 4), **extra)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not cache page {page_num}: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits its cap
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                pass
@@ -4,7 +4,10 @@ import os
 
 def remove_rectangles(image_path, rectangles_file, output_path, save = 0):
     
-    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if isinstance(image_path, str):
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    else:
+        image = image_path.copy()   # Keep the caller's page untouched, gray stays gray
     
     if __name__ == '__main__':
         # Read matches log file
@@ -16,7 +19,7 @@ def remove_rectangles(image_path, rectangles_file, output_path, save = 0):
     
     # Paint whie the area of the matches found 
     for (x_initial, y_initial, x_final, y_final) in rectangles:
-        image[y_initial:y_final, x_initial:x_final] = (255, 255, 255)
+        image[y_initial:y_final, x_initial:x_final] = 255
 
     # Save simplified image
     if save:
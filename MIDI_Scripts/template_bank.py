@@ -0,0 +1,126 @@
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+
+TEMPLATES_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Staff spacing (pixels) of the pages the templates were cut from: the median of
+# page_layout.estimate_staff_spacing over the clef and rest templates, which show staff lines
+TEMPLATE_STAFF_SPACE = 21
+
+# One decoded template with the statistics TM_CCOEFF_NORMED needs:
+# mean gray level and the norm of the zero-mean template
+Template = namedtuple('Template', ['name', 'image', 'width', 'height', 'mean', 'norm'])
+
+
+def make_template(name, image):
+    height, width = image.shape
+    mean = float(image.mean())
+    norm = float(np.sqrt(((image.astype(np.float64) - mean) ** 2).sum()))
+    return Template(name, image, width, height, mean, norm)
+
+
+def load_template(path):
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    return make_template(os.path.basename(path), image)
+
+
+def scale_template(template, scale):
+    # Area averaging when shrinking, bicubic when enlarging
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    width = max(1, int(round(template.width * scale)))
+    height = max(1, int(round(template.height * scale)))
+    return make_template(template.name, cv2.resize(template.image, (width, height), interpolation=interpolation))
+
+
+class TemplateBank:
+    """
+    Templates decoded and grayscaled once per process, per directory.
+
+    Directories are given as in main.process_sheet_music's templates_dirs ('Core/Notes_Full/'),
+    relative to the templates folder, or as absolute paths. They are loaded on first use
+    (or up front with preload) and kept for every later page and call.
+    """
+    def __init__(self, root=TEMPLATES_ROOT):
+        self.root = root
+        self._dirs = {}
+        self._scaled = {}
+
+    def _key(self, templates_dir):
+        if not os.path.isabs(templates_dir):
+            templates_dir = os.path.join(self.root, templates_dir)
+        return os.path.normpath(templates_dir)
+
+    def get(self, templates_dir, scale=1.0):
+        """
+        List of Template for a directory, in listing order.
+        scale resizes them (see staff_scale); each scaled set is built once and kept.
+        """
+        key = self._key(templates_dir)
+        scale = round(scale, 2)
+        if scale != 1.0:
+            if (key, scale) not in self._scaled:
+                self._scaled[(key, scale)] = [scale_template(t, scale) for t in self.get(templates_dir)]
+            return self._scaled[(key, scale)]
+
+        if key not in self._dirs:
+            templates = []
+            for name in os.listdir(key):
+                if name.endswith(IMAGE_EXTENSIONS):
+                    template = load_template(os.path.join(key, name))
+                    if template is not None:
+                        templates.append(template)
+            self._dirs[key] = templates
+        return self._dirs[key]
+
+    def preload(self, templates_dirs):
+        # Accepts plain paths or the templates_dirs dicts of main.py
+        for templates_dir in templates_dirs:
+            self.get(templates_dir['path'] if isinstance(templates_dir, dict) else templates_dir)
+        return self
+
+    @classmethod
+    def from_pack(cls, pack_path, root=TEMPLATES_ROOT):
+        """Bank holding every category of a compiled pack (see template_pack.py), memory-mapped."""
+        from template_pack import read_pack
+        bank = cls(root)
+        for category, templates in read_pack(pack_path).items():
+            bank._dirs[bank._key(category)] = templates
+        return bank
+
+    def __len__(self):
+        return sum(len(templates) for templates in self._dirs.values())
+
+
+def staff_scale(staff_space, tolerance=0.05):
+    """
+    Template scale for a page with the given staff spacing. Pages within tolerance of the
+    templates' own spacing keep the originals; 1.0 when the spacing is unknown.
+    """
+    if not staff_space:
+        return 1.0
+    scale = staff_space / TEMPLATE_STAFF_SPACE
+    return 1.0 if abs(scale - 1) <= tolerance else scale
+
+
+# Shared by every matching call in this process (final.py handles all pages in one)
+_default_bank = None
+
+def get_template_bank():
+    # One mmap of the compiled pack when it is up to date, loose files otherwise
+    global _default_bank
+    if _default_bank is None:
+        from template_pack import DEFAULT_PACK, pack_is_current
+        if pack_is_current(DEFAULT_PACK):
+            _default_bank = TemplateBank.from_pack(DEFAULT_PACK)
+        else:
+            if os.path.isfile(DEFAULT_PACK):
+                print('Template pack is out of date, loading template files (rebuild with template_pack.py)')
+            _default_bank = TemplateBank()
+    return _default_bank
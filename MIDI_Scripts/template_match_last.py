@@ -2,6 +2,11 @@ import cv2
 import numpy as np
 import os
 
+from template_bank import TemplateBank, get_template_bank
+from matching_engines import match_templates
+from match_peaks import box_nms
+from page_raster import BilevelPage
+
 
 verb = False
 
@@ -45,19 +50,15 @@ def std_rects(rectangles):
         return standardized_rectangles
     
     
-def contained_match(rectangles):
-    formated_rect = [tup[0] + tup[1] for tup in rectangles]
-    for (x_initial, y_initial, x_final, y_final) in formated_rect:
-        """
-        if (x_initial[i] <= x_initial[k] and x_final[k] <= x_final[i] and \
-            y_initial[i] <= y_initial[k] and y_final[k] <= y_final[i]):
-            
-            delete rectangle[k]
-        
-        """
+def contained_match(rectangles, max_contained=0.9):
+    # Drop rectangles lying (max_contained of their area) inside a better-scoring one, or
+    # holding a better-scoring one inside them
+    return box_nms(rectangles, max_overlap=1.0, max_contained=max_contained)
 
 def multi_template_match(main_image_path, templates_dir, output_directory,\
-                         threshold = 0.8, min_distance=15, skip_templates = None):
+                         threshold = 0.8, min_distance=15, skip_templates = None, bank = None,\
+                         engine = 'full', pyramid_factor = 0.5, scale = 1.0, top_k = None, staff_space = None,\
+                         max_candidates = None, calibrate = None, windows = None):
     if not os.path.isdir(output_directory):
         os.makedirs(output_directory)
         
@@ -69,66 +70,40 @@ def multi_template_match(main_image_path, templates_dir, output_directory,\
 
     # print(main_image_path);
         
-    main_image_gray = cv2.cvtColor(main_image, cv2.COLOR_BGR2GRAY)
-    
-    # Switch to the templates directory when executing as a module to simplify path references
-    templates_directory = os.path.join(os.path.dirname(__file__), 'templates')
-
-    # Construct the full path if it's not already
-    if not os.path.isabs(templates_dir):
-        templates_dir = os.path.join(templates_directory, templates_dir)
+    # Pages rendered straight to grayscale are used as they are
+    if isinstance(main_image, BilevelPage):
+        main_image_gray = main_image.unpack()
+    elif main_image.ndim == 2:
+        main_image_gray = main_image
+    else:
+        main_image_gray = cv2.cvtColor(main_image, cv2.COLOR_BGR2GRAY)
     
-
-    templates = [f for f in os.listdir(templates_dir) if f.endswith(('.png', '.jpg', '.jpeg'))]
-    all_matches = []  # List to keep track of all matches
-
-    # Initialize template usage dictionary with all templates set to zero
-    template_usage = {template_name: 0 for template_name in templates}
+    # Templates are decoded once per process and shared by every page and category
+    # (relative directories are looked up under MIDI_Scripts/templates).
+    # bank may also be the path of a compiled pack (template_pack.py)
+    if bank is None:
+        bank = get_template_bank()
+    elif isinstance(bank, str):
+        bank = TemplateBank.from_pack(bank)
+    # Scaled to the page's staff spacing when scale != 1 (template_bank.staff_scale)
+    templates = bank.get(templates_dir, scale)
 
     # Preliminary template matching
     if skip_templates is None:
         skip_templates = []
     skip_templates_names = [os.path.basename(path) for path in skip_templates]
+    selected = [entry for entry in templates if entry.name not in skip_templates_names]
 
-    for template_name in templates:
-        template_pathname = os.path.basename(template_name)
-        if template_pathname in skip_templates_names:
-            continue
-        
-        template_path = os.path.join(templates_dir, template_name)
-        template = cv2.imread(template_path, 0)
-        w, h = template.shape[::-1]
-
-        # res = cv2.matchTemplate(main_image_gray, template, cv2.TM_CCOEFF_NORMED)
-        if main_image_gray.shape[0] >= template.shape[0] and main_image_gray.shape[1] >= template.shape[1]:
-            res = cv2.matchTemplate(main_image_gray, template, cv2.TM_CCOEFF_NORMED)
-        else:
-            res = 0
+    # The engine (matching_engines.py) finds the candidates; they are then sorted and
+    # filtered by proximity the same way for every engine
+    final_matches, usage = match_templates(main_image_gray, selected, threshold, min_distance, engine, top_k,
+                                           max_candidates, calibrate,
+                                           pyramid_factor = pyramid_factor, staff_space = staff_space, windows = windows,
+                                           bilevel = main_image if isinstance(main_image, BilevelPage) else None)
 
-        loc = np.where(res >= threshold)
-        
-        # Format matches log
-        for pt in zip(*loc[::-1]):
-            confidence = res[pt[1], pt[0]]  # Get match quality score
-            all_matches.append((pt, (pt[0] + w, pt[1] + h), confidence, template_name))
-
-    # Sort matches by confidence
-    all_matches.sort(key=lambda x: x[2], reverse=True)
-
-    # Filter matches by proximity to similar mathces to avoid repeated 
-    final_matches = []
-    for match in all_matches:
-        match_center = center((match[0][0], match[0][1], match[1][0] - match[0][0],\
-                               match[1][1] - match[0][1]))
-        if not any(distance(center(\
-                (final_match[0][0], final_match[0][1],\
-                 final_match[1][0] - final_match[0][0],\
-                 final_match[1][1] - final_match[0][1])),\
-                    match_center) < min_distance for final_match in final_matches):
-            final_matches.append(match)
-            # Update template counter 
-            template_name = match[3]  # Template name at index 3
-            template_usage[template_name] += 1
+    # Template usage with all templates, skipped ones at zero
+    template_usage = {template.name: 0 for template in templates}
+    template_usage.update(usage)
 
     # Standardize sizes
     resized_matches = std_rects(final_matches)
@@ -136,13 +111,15 @@ def multi_template_match(main_image_path, templates_dir, output_directory,\
     # Draw rectangles of the final matches
     # for match in resized_matches:
         # cv2.rectangle(main_image, match[0], match[1], (0, 255, 0), 2)
-    for ((x_initial, y_initial), (x_final, y_final), score, name) in resized_matches:
-        # Ensure the coordinates are integers
-        x_initial, y_initial, x_final, y_final = map(int, [x_initial, y_initial, x_final, y_final])
-        
-        if verb: color = color_gradient_score(score, min_score = threshold)
-        else: color = (0, 255, 0)
-        cv2.rectangle(main_image, (x_initial, y_initial), (x_final, y_final), color, 2)
+    # A grayscale page is shared between categories, so it is never drawn on
+    if getattr(main_image, 'ndim', 2) == 3:
+        for ((x_initial, y_initial), (x_final, y_final), score, name) in resized_matches:
+            # Ensure the coordinates are integers
+            x_initial, y_initial, x_final, y_final = map(int, [x_initial, y_initial, x_final, y_final])
+            
+            if verb: color = color_gradient_score(score, min_score = threshold)
+            else: color = (0, 255, 0)
+            cv2.rectangle(main_image, (x_initial, y_initial), (x_final, y_final), color, 2)
     
     if __name__ == '__main__':
         # Save the result
@@ -0,0 +1,94 @@
+"""
+Compiled template pack: the whole templates tree in one memory-mappable .npy file.
+
+Layout of the uint8 array saved in the file:
+
+    [0:8]           little-endian length n of the index
+    [8:8+n]         index, UTF-8 JSON: list of {category, name, offset, height, width, mean, norm}
+    [8+n+offset:]   each template's gray pixels, row-major, height * width bytes
+
+category is the template's folder relative to the templates root ('Core/Notes_Full'),
+as used in main.py's templates_dirs. Build it with:
+
+    python template_pack.py [templates_root] [pack_path]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from template_bank import TEMPLATES_ROOT, IMAGE_EXTENSIONS, Template, load_template
+
+
+DEFAULT_PACK = os.path.join(TEMPLATES_ROOT, 'templates.pack.npy')
+
+
+def build_pack(templates_root=TEMPLATES_ROOT, pack_path=DEFAULT_PACK):
+    """Compile every template image under templates_root into pack_path."""
+    index = []
+    pixels = []
+    offset = 0
+    for directory, _, files in sorted(os.walk(templates_root)):
+        category = os.path.relpath(directory, templates_root).replace(os.sep, '/')
+        # Same listing order as TemplateBank.get on the loose files
+        for name in [f for f in os.listdir(directory) if f.endswith(IMAGE_EXTENSIONS)]:
+            template = load_template(os.path.join(directory, name))
+            if template is None:
+                print(f'Skipping unreadable template: {os.path.join(category, name)}')
+                continue
+            index.append({'category': category, 'name': name, 'offset': offset,
+                          'height': template.height, 'width': template.width,
+                          'mean': template.mean, 'norm': template.norm})
+            pixels.append(template.image.ravel())
+            offset += template.image.size
+
+    header = json.dumps(index).encode('utf-8')
+    blob = np.concatenate([np.frombuffer(np.array(len(header), dtype='<u8').tobytes(), dtype=np.uint8),
+                           np.frombuffer(header, dtype=np.uint8)] + pixels)
+    np.save(pack_path, blob)
+    print(f'Packed {len(index)} templates into {pack_path} ({blob.size / 1024:.0f} KB)')
+    return pack_path
+
+
+def read_pack(pack_path=DEFAULT_PACK):
+    """
+    Map a pack and return {category: [Template, ...]}. Template images are views
+    into the mapped file, so nothing is decoded or copied.
+    """
+    blob = np.load(pack_path, mmap_mode='r')
+    length = int(np.frombuffer(blob[:8].tobytes(), dtype='<u8')[0])
+    index = json.loads(blob[8:8 + length].tobytes().decode('utf-8'))
+
+    categories = {}
+    for entry in index:
+        start = 8 + length + entry['offset']
+        image = blob[start:start + entry['height'] * entry['width']].reshape(entry['height'], entry['width'])
+        categories.setdefault(entry['category'], []).append(
+            Template(entry['name'], image, entry['width'], entry['height'], entry['mean'], entry['norm']))
+    return categories
+
+
+def pack_is_current(pack_path=DEFAULT_PACK, templates_root=TEMPLATES_ROOT):
+    # Adding, removing, renaming or editing a template makes the pack stale. Only the
+    # folders below the root and the images count: build artifacts saved in the root
+    # (packs, component_classifier's model) must not make each other stale
+    if not os.path.isfile(pack_path):
+        return False
+    pack_time = os.path.getmtime(pack_path)
+    root = os.path.normpath(templates_root)
+    for directory, _, files in os.walk(templates_root):
+        paths = [directory] if os.path.normpath(directory) != root else []
+        paths += [os.path.join(directory, f) for f in files if f.endswith(IMAGE_EXTENSIONS)]
+        if any(os.path.getmtime(path) > pack_time for path in paths):
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile the template folders into one pack file')
+    parser.add_argument('templates_root', nargs='?', default=TEMPLATES_ROOT)
+    parser.add_argument('pack_path', nargs='?', default=None)
+    args = parser.parse_args()
+
+    build_pack(args.templates_root, args.pack_path or os.path.join(args.templates_root, 'templates.pack.npy'))
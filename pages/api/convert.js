@@ -49,65 +49,34 @@ export default async function handler(req, res) {
         const responseStream = new PassThrough();
         responseStream.pipe(res);
 
-        // First Python process (convert_best.py)
-        const pythonProcess = spawn('python3', [
-            '-u',
-            path.resolve(PROJECT_PATHS.MIDI_SCRIPTS, 'convert_best.py'),
-            pdfPath,
-            '',
-            inputDir
-        ]);
-
-        pythonProcess.stdout.on('data', (data) => {
-            console.log('Python stdout:', data.toString());
-            responseStream.write(`data: ${JSON.stringify({ type: 'stdout', message: data.toString() })}\n\n`);
-            res.flush();
-        });
-
-        pythonProcess.stderr.on('data', (data) => {
-            console.error('Python stderr:', data.toString());
-            responseStream.write(`data: ${JSON.stringify({ type: 'stderr', message: data.toString() })}\n\n`);
-            res.flush();
-        });
-
-        // Wait for first process to complete
-        await new Promise((resolve, reject) => {
-            pythonProcess.on('close', (code) => {
-                if (code === 0) {
-                    responseStream.write(`data: ${JSON.stringify({ type: 'status', message: 'First conversion complete' })}\n\n`);
-                    resolve();
-                } else {
-                    reject(new Error(`Python process exited with code ${code}`));
-                }
-            });
-            pythonProcess.on('error', (error) => {
-                console.error('Process error:', error);
-                reject(error);
-            });
-        });
-
-        // Get the first converted image
-        const images = fs.readdirSync(inputDir).filter(file => file.endsWith('.png'));
-        if (images.length === 0) {
-            throw new Error('No images were generated');
-        }
-
-        // Second Python process (final.py)
+        // Single Python process: pages are rendered in the background and
+        // recognized as soon as they are ready (final.py --pdf --stream)
         const finalProcess = spawn('python3', [
             '-u',
             path.resolve(PROJECT_PATHS.MIDI_SCRIPTS, 'final.py'),
-            tempDir
+            tempDir,
+            '--pdf',
+            '--stream',
+            '--preview'
         ]);
 
-        // Wait for second process to complete
+        // Wait for the process to complete
         await new Promise((resolve, reject) => {
             finalProcess.on('close', (code) => {
                 if (code === 0) {
-                    const imagePath = `/api/images/${sessionId}/in/${images[0]}`;
+                    // in/ holds a thumbnail of every page (final.py --preview); the first is shown
+                    const images = fs.readdirSync(inputDir).filter(file => file.endsWith('.png'));
+                    const imagePath = images.length > 0 ? `/api/images/${sessionId}/in/${images[0]}` : null;
+                    // Pages without staff systems that final.py did not recognize
+                    const skippedPath = path.join(finalOutputDir, 'skipped_pages.txt');
+                    const skippedPages = fs.existsSync(skippedPath)
+                        ? fs.readFileSync(skippedPath, 'utf8').split('\n').filter(Boolean).map(Number)
+                        : [];
                     responseStream.write(`data: ${JSON.stringify({
                         type: 'complete',
                         message: 'Conversion complete',
-                        imagePath: imagePath
+                        imagePath: imagePath,
+                        skippedPages: skippedPages
                     })}\n\n`);
                     responseStream.end();
                     resolve();
@@ -11,9 +11,15 @@ import { v4 as uuidv4 } from 'uuid';
 import { PROJECT_PATHS } from '../../constants/paths';
 import multer from 'multer';
 
-// Configure multer
+// Configure multer: the upload keeps a .pdf name, final.py --pdf looks for one in pdf/
 const configureMulter = (tempDir) => multer({
-    dest: tempDir,
+    storage: multer.diskStorage({
+        destination: tempDir,
+        filename: (req, file, cb) => {
+            const base = path.basename(file.originalname || 'score', path.extname(file.originalname || ''));
+            cb(null, `${base.replace(/[^\w.-]+/g, '_') || 'score'}.pdf`);
+        },
+    }),
     limits: { fileSize: 10 * 1024 * 1024 }, // 10MB limit
 });
 
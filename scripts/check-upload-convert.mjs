@@ -0,0 +1,48 @@
+// Upload a PDF through /api/upload, then run /api/convert on its session, the way the
+// page does, and fail unless the conversion completes.
+//
+//     npm run dev   (in another terminal)
+//     npm run check:upload -- path/to/score.pdf [http://localhost:3000]
+import fs from 'fs';
+import path from 'path';
+
+const [pdfPath, baseUrl = 'http://localhost:3000'] = process.argv.slice(2);
+if (!pdfPath) {
+    console.error('Usage: node scripts/check-upload-convert.mjs <pdf> [base_url]');
+    process.exit(2);
+}
+
+const formData = new FormData();
+formData.append('pdf', new Blob([fs.readFileSync(pdfPath)], { type: 'application/pdf' }), path.basename(pdfPath));
+
+const uploadResponse = await fetch(`${baseUrl}/api/upload`, { method: 'POST', body: formData });
+const upload = await uploadResponse.json();
+if (!uploadResponse.ok || !upload.sessionId) {
+    console.error('Upload failed:', upload.error || uploadResponse.status);
+    process.exit(1);
+}
+console.log(`Uploaded, session ${upload.sessionId}`);
+
+// Server-sent events: read until 'complete' or 'error'
+const convertResponse = await fetch(`${baseUrl}/api/convert?sessionId=${upload.sessionId}`);
+const decoder = new TextDecoder();
+let buffered = '';
+for await (const chunk of convertResponse.body) {
+    buffered += decoder.decode(chunk, { stream: true });
+    const events = buffered.split('\n\n');
+    buffered = events.pop();
+    for (const event of events) {
+        if (!event.startsWith('data: ')) continue;
+        const data = JSON.parse(event.slice(6));
+        if (data.type === 'complete') {
+            console.log(`Conversion complete, preview ${data.imagePath}`);
+            process.exit(0);
+        }
+        if (data.type === 'error') {
+            console.error('Conversion failed:', data.message);
+            process.exit(1);
+        }
+    }
+}
+console.error('Conversion stream ended without completing');
+process.exit(1);